@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from copy import copy
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.authtoken.models import Token
+
+
+class TokenCache:
+    """Кэш токен -> пользователь: LRU с TTL в процессе и общий кэш Django.
+
+    Общий кэш очищается сигналами сразу, локальная копия в других
+    воркерах живёт не дольше local_timeout секунд.
+    """
+
+    def __init__(self, alias, size, local_timeout, timeout):
+        self.alias = alias
+        self.size = size
+        self.local_timeout = local_timeout
+        self.timeout = timeout
+        self.lock = Lock()
+        self.local = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        return f'auth-token:{sha256(key.encode()).hexdigest()}'
+
+    def get(self, key):
+        cache_key = self.make_key(key)
+        with self.lock:
+            entry = self.local.get(cache_key)
+            if entry is not None:
+                user, expires = entry
+                if expires > monotonic():
+                    self.local.move_to_end(cache_key)
+                    return copy(user)
+                del self.local[cache_key]
+        user = self.shared.get(cache_key)
+        if user is not None:
+            self.set_local(cache_key, user)
+        return user
+
+    def set(self, key, user):
+        cache_key = self.make_key(key)
+        self.shared.set(cache_key, user, self.timeout)
+        self.set_local(cache_key, user)
+
+    def set_local(self, cache_key, user):
+        if not self.local_timeout:
+            return
+        with self.lock:
+            self.local[cache_key] = (
+                copy(user), monotonic() + self.local_timeout)
+            self.local.move_to_end(cache_key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def invalidate(self, *keys):
+        cache_keys = [self.make_key(key) for key in keys]
+        self.shared.delete_many(cache_keys)
+        with self.lock:
+            for cache_key in cache_keys:
+                self.local.pop(cache_key, None)
+
+
+token_cache = TokenCache(
+    alias=settings.AUTH_TOKEN_CACHE_ALIAS,
+    size=settings.AUTH_TOKEN_CACHE_SIZE,
+    local_timeout=settings.AUTH_TOKEN_CACHE_LOCAL_TIMEOUT,
+    timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT,
+)
+
+
+def get_client_address(request):
+    """Адрес клиента: nginx передаёт его в X-Real-IP."""
+    if request is None:
+        return ''
+    return (request.META.get('HTTP_X_REAL_IP')
+            or request.META.get('REMOTE_ADDR', ''))
+
+
+class LoginFailures:
+    """Счётчик неудачных входов по паре адрес клиента + email.
+
+    После limit неудач за timeout секунд пароль для этой пары
+    не проверяется до конца окна, чтобы перебор не тратил CPU на хэши.
+    Блокировка не касается входа с других адресов, поэтому чужой
+    перебор не закрывает владельцу доступ к аккаунту.
+    """
+
+    def __init__(self, alias, limit, timeout):
+        self.alias = alias
+        self.limit = limit
+        self.timeout = timeout
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def make_key(self, email, address):
+        value = f'{address}|{email.strip().lower()}'
+        digest = sha256(value.encode()).hexdigest()
+        return f'login-failures:{digest}'
+
+    def is_blocked(self, email, address):
+        key = self.make_key(email, address)
+        return self.shared.get(key, 0) >= self.limit
+
+    def add(self, email, address):
+        key = self.make_key(email, address)
+        self.shared.add(key, 0, self.timeout)
+        try:
+            self.shared.incr(key)
+        except ValueError:
+            self.shared.set(key, 1, self.timeout)
+
+    def reset(self, email, address):
+        self.shared.delete(self.make_key(email, address))
+
+
+login_failures = LoginFailures(
+    alias=settings.AUTH_TOKEN_CACHE_ALIAS,
+    limit=settings.LOGIN_FAILURE_LIMIT,
+    timeout=settings.LOGIN_FAILURE_TIMEOUT,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для уже известных токенов.
+
+    Кэш используется только для чтения: пользователь загружается без
+    хэша пароля, чтобы тот не попадал в общий кэш. Для изменяющих
+    запросов пользователь читается из базы, чтобы его сохранение
+    не записало устаревшую копию.
+    """
+
+    use_cache = True
+
+    def authenticate(self, request):
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not self.use_cache:
+            return super().authenticate_credentials(key)
+        user = token_cache.get(key)
+        if user is not None:
+            return user, Token(key=key, user=user)
+        try:
+            token = Token.objects.select_related('user').defer(
+                'user__password').get(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        token_cache.set(key, token.user)
+        return token.user, token
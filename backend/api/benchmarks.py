@@ -0,0 +1,892 @@
+import csv
+import json
+import os
+import random
+from base64 import b64encode
+from collections import defaultdict
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.pagination import Cursor
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.authentication import (CachedTokenAuthentication, login_failures,
+                                token_cache)
+from api.cache import feed_cache, reference_cache
+from api.metrics import registry
+from api.pagination import RecipeCursorPagination
+from api.parsers import ORJSONParser
+from api.renderers import ORJSONRenderer
+from api.serializers import RecipeCreateSerializer
+from recipes import carts
+from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
+                            Recipe, ShoppingList, Tag)
+from recipes.matching import recipe_matcher
+from recipes.search import ingredient_index, update_search_vectors
+from recipes.signals import ingredients_imported, recipes_changed
+from users.models import Follow, User
+
+SCENARIOS = {}
+
+BENCH_PASSWORD = 'Bench-Load-Password'
+
+
+def scenario(name):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def reset_caches():
+    """Сбрасывает кэши, чтобы сценарий не видел данных предыдущего."""
+    for cache in caches.all():
+        cache.clear()
+    for local_cache in (reference_cache, token_cache):
+        with local_cache.lock:
+            local_cache.local.clear()
+    recipe_matcher.invalidate()
+    ingredient_index.invalidate()
+
+
+def measure(func, *args, **kwargs):
+    with CaptureQueriesContext(connection) as queries:
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = (perf_counter() - start) * 1000
+    return result, len(queries), elapsed
+
+
+def create_users(count, prefix='bench'):
+    User.objects.bulk_create(
+        User(
+            username=f'{prefix}{number}',
+            email=f'{prefix}{number}@example.com',
+            first_name='Bench',
+            last_name='User',
+        ) for number in range(count)
+    )
+    return list(
+        User.objects.filter(username__startswith=prefix).order_by('id'))
+
+
+def create_ingredients(count, prefix='bench ingredient'):
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'{prefix} {number}', measurement_unit='г')
+        for number in range(count)
+    )
+    ingredients_imported.send(sender=Ingredient)
+    return list(
+        Ingredient.objects.filter(name__startswith=prefix).order_by('id'))
+
+
+def create_recipes(author, ingredients, count, per_recipe=10):
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author,
+            name=f'recipe {number}',
+            image='recipes/image/bench.jpg',
+            text='bench',
+            cooking_time=10,
+        ) for number in range(count)
+    )
+    recipes = list(Recipe.objects.filter(author=author).order_by('id'))
+    AmountIngredient.objects.bulk_create(
+        AmountIngredient(
+            recipe=recipe,
+            ingredient=ingredients[
+                (number + shift) % len(ingredients)],
+            amount=number % 5 + 1,
+        )
+        for number, recipe in enumerate(recipes)
+        for shift in range(per_recipe)
+    )
+    recipes_changed.send(sender=Recipe)
+    return recipes
+
+
+def spread_pub_dates(recipes, step=timedelta(minutes=1)):
+    start = timezone.now()
+    for number, recipe in enumerate(recipes):
+        recipe.pub_date = start - step * number
+    Recipe.objects.bulk_update(recipes, ['pub_date'], batch_size=1000)
+
+
+def get_client(user=None):
+    client = APIClient()
+    if user is not None:
+        client.force_authenticate(user)
+    return client
+
+
+def download(client, url, **extra):
+    """Ответ вместе с телом: запросы к базе идут при чтении потока."""
+    response = client.get(url, **extra)
+    return response, b''.join(response.streaming_content)
+
+
+@scenario('shopping_cart')
+def shopping_cart_benchmark(stdout, options):
+    author, user = create_users(2)
+    ingredients = create_ingredients(50)
+    recipes = create_recipes(author, ingredients, 100)
+    client = get_client(user)
+    added = 0
+    for size in (1, 10, 40, 100):
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=user, recipe=recipe)
+            for recipe in recipes[added:size]
+        )
+        carts.add_recipes(
+            user, [recipe.pk for recipe in recipes[added:size]])
+        added = size
+        (response, _), queries, elapsed = measure(
+            download, client, '/api/recipes/download_shopping_cart/')
+        stdout.write(
+            f'cart={size:<4} status={response.status_code} '
+            f'queries={queries:<3} time={elapsed:.1f}ms'
+        )
+    for export_format in ('txt', 'csv', 'pdf'):
+        url = f'/api/recipes/download_shopping_cart/?format={export_format}'
+        (response, body), queries, elapsed = measure(download, client, url)
+        cached, _, _ = measure(
+            client.get, url, HTTP_IF_NONE_MATCH=response['ETag'])
+        stdout.write(
+            f'format={export_format} status={response.status_code} '
+            f'size={len(body)} queries={queries} time={elapsed:.1f}ms '
+            f'repeat={cached.status_code}'
+        )
+
+
+@scenario('recipe_list')
+def recipe_list_benchmark(stdout, options):
+    author, user = create_users(2)
+    ingredients = create_ingredients(50)
+    recipes = create_recipes(author, ingredients, 100)
+    FavoriteRecipe.objects.bulk_create(
+        FavoriteRecipe(user=user, recipe=recipe) for recipe in recipes[::2])
+    ShoppingList.objects.bulk_create(
+        ShoppingList(user=user, recipe=recipe) for recipe in recipes[::3])
+    Follow.objects.create(user=user, author=author)
+    for client_user in (None, user):
+        client = get_client(client_user)
+        for limit in (6, 20, 100):
+            response, queries, elapsed = measure(
+                client.get, f'/api/recipes/?limit={limit}')
+            stdout.write(
+                f'user={"auth" if client_user else "anon"} '
+                f'limit={limit:<4} status={response.status_code} '
+                f'queries={queries:<4} time={elapsed:.1f}ms'
+            )
+
+
+@scenario('subscriptions')
+def subscriptions_benchmark(stdout, options):
+    (user,) = create_users(1, prefix='follower')
+    authors = create_users(100, prefix='author')
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author,
+            name=f'recipe {number}',
+            image='recipes/image/bench.jpg',
+            text='bench',
+            cooking_time=10,
+        ) for author in authors for number in range(5)
+    )
+    Follow.objects.bulk_create(
+        Follow(user=user, author=author) for author in authors)
+    client = get_client(user)
+    for limit in (1, 10, 100):
+        response, queries, elapsed = measure(
+            client.get,
+            f'/api/users/subscriptions/?limit={limit}&recipes_limit=3')
+        stdout.write(
+            f'authors={limit:<4} status={response.status_code} '
+            f'queries={queries:<4} time={elapsed:.1f}ms'
+        )
+
+
+@scenario('ingredient_search')
+def ingredient_search_benchmark(stdout, options):
+    with open(
+            os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            encoding='UTF-8'
+    ) as ingredients:
+        Ingredient.objects.bulk_create(
+            Ingredient(name=row[0], measurement_unit=row[1])
+            for row in csv.reader(ingredients) if len(row) == 2
+        )
+    limit = settings.INGREDIENT_SEARCH_LIMIT
+    ingredient_index.invalidate()
+    _, _, elapsed = measure(ingredient_index.get_entries)
+    stdout.write(f'index build={elapsed:.1f}ms')
+    client = get_client()
+    for query in ('мо', 'молоко', 'соль', 'сыр'):
+        response, queries, db_elapsed = measure(
+            client.get, '/api/ingredients/', {'name': query})
+        found, _, index_elapsed = measure(
+            ingredient_index.search, query, limit)
+        stdout.write(
+            f'query={query:<8} found={len(found):<3} '
+            f'api={db_elapsed:.2f}ms ({queries} queries) '
+            f'index={index_elapsed:.3f}ms'
+        )
+
+
+@scenario('reference_cache')
+def reference_cache_benchmark(stdout, options):
+    Tag.objects.bulk_create(
+        Tag(name=f'bench tag {number}', color=f'#bench{number}',
+            slug=f'bench-tag-{number}')
+        for number in range(10)
+    )
+    create_ingredients(500)
+    client = get_client()
+    for url in ('/api/tags/', '/api/ingredients/?name=bench'):
+        reference_cache.invalidate(url.split('/')[2])
+        cold, cold_queries, cold_elapsed = measure(client.get, url)
+        _, warm_queries, warm_elapsed = measure(client.get, url)
+        cached, _, cached_elapsed = measure(
+            client.get, url, HTTP_IF_NONE_MATCH=cold['ETag'])
+        stdout.write(
+            f'{url:<30} cold={cold_elapsed:.2f}ms ({cold_queries} queries) '
+            f'warm={warm_elapsed:.2f}ms ({warm_queries} queries) '
+            f'revalidate={cached.status_code} {cached_elapsed:.2f}ms'
+        )
+
+
+@scenario('ingredient_import')
+def ingredient_import_benchmark(stdout, options):
+    for name in ('ingredients.csv', 'ingredients.json', 'ingredients.csv'):
+        path = os.path.join(settings.BASE_DIR, 'data', name)
+        _, queries, elapsed = measure(
+            call_command, 'import_ingredients_csv', path, stdout=stdout)
+        stdout.write(
+            f'{name:<17} total={Ingredient.objects.count()} '
+            f'queries={queries} time={elapsed:.1f}ms'
+        )
+
+
+@scenario('recipe_pagination')
+def recipe_pagination_benchmark(stdout, options):
+    (author,) = create_users(1)
+    ingredients = create_ingredients(20)
+    recipes = create_recipes(author, ingredients, 6000, per_recipe=3)
+    spread_pub_dates(recipes)
+    client = get_client()
+    paginator = RecipeCursorPagination()
+    paginator.base_url = 'http://testserver/api/recipes/?limit=6'
+    for page in (1, 1000):
+        deep = recipes[(page - 1) * 6 - 1] if page > 1 else None
+        cursor = paginator.encode_cursor(Cursor(
+            offset=0, reverse=False,
+            position=deep and deep.pub_date.isoformat(),
+        ))
+        for mode, url in (
+            ('page', f'/api/recipes/?page={page}&limit=6'),
+            ('cursor', cursor),
+        ):
+            response, queries, elapsed = measure(client.get, url)
+            first = response.json()['results'][0]['name']
+            stdout.write(
+                f'page={page:<5} mode={mode:<6} first={first:<12} '
+                f'queries={queries} time={elapsed:.1f}ms'
+            )
+
+
+def count_writes(func, *args, **kwargs):
+    """Выполняет func и считает запросы INSERT, UPDATE и DELETE."""
+    with CaptureQueriesContext(connection) as queries:
+        result = func(*args, **kwargs)
+    writes = [
+        query['sql'].split(None, 1)[0].upper() for query in queries
+        if query['sql'].lstrip().upper().startswith(
+            ('INSERT', 'UPDATE', 'DELETE'))
+    ]
+    return result, len(queries), writes
+
+
+@scenario('recipe_update')
+def recipe_update_benchmark(stdout, options):
+    (author,) = create_users(1)
+    ingredients = create_ingredients(40)
+    Tag.objects.bulk_create(
+        Tag(name=f'bench tag {number}', color=f'#bench{number}',
+            slug=f'bench-tag-{number}')
+        for number in range(3)
+    )
+    tags = list(Tag.objects.filter(slug__startswith='bench-tag-'))
+    (recipe,) = create_recipes(author, ingredients, 1, per_recipe=30)
+    recipe.tags.set(tags[:2])
+    amounts = [
+        {'id': item.ingredient_id, 'amount': item.amount}
+        for item in recipe.recipe.order_by('pk')
+    ]
+    added = {'id': ingredients[35].id, 'amount': 1}
+    tag_ids = [tag.id for tag in tags[:2]]
+    changes = (
+        ('same', amounts, tag_ids),
+        ('one amount', [{**amounts[0], 'amount': 100}] + amounts[1:],
+         tag_ids),
+        ('one added', amounts[1:] + [added], tag_ids),
+        ('one removed', amounts[2:] + [added], tag_ids),
+        ('one tag', amounts[2:] + [added], [tag.id for tag in tags[1:]]),
+    )
+    client = get_client(author)
+    for label, data, tag_ids in changes:
+        response, queries, writes = count_writes(
+            client.patch, f'/api/recipes/{recipe.id}/',
+            {'ingredients': data, 'tags': tag_ids}, format='json')
+        summary = ' '.join(
+            f'{kind}={writes.count(kind)}'
+            for kind in ('INSERT', 'UPDATE', 'DELETE'))
+        stdout.write(
+            f'{label:<12} status={response.status_code} '
+            f'queries={queries:<3} {summary}'
+        )
+
+
+def png_base64(size=64):
+    buffer = BytesIO()
+    Image.new('RGB', (size, size)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + b64encode(buffer.getvalue()).decode()
+
+
+@scenario('recipe_validation')
+def recipe_validation_benchmark(stdout, options):
+    ingredients = create_ingredients(200)
+    Tag.objects.bulk_create(
+        Tag(name=f'bench tag {number}', color=f'#bench{number}',
+            slug=f'bench-tag-{number}')
+        for number in range(3)
+    )
+    tag_ids = list(Tag.objects.filter(
+        slug__startswith='bench-tag-').values_list('id', flat=True))
+    image = png_base64()
+    for size in (5, 50, 200):
+        data = {
+            'tags': tag_ids,
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in ingredients[:size]
+            ],
+            'name': 'Проверка',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': image,
+        }
+        serializer = RecipeCreateSerializer(data=data)
+        valid, queries, elapsed = measure(serializer.is_valid)
+        stdout.write(
+            f'ingredients={size:<4} valid={valid} '
+            f'queries={queries} time={elapsed:.1f}ms'
+        )
+    data['ingredients'].append({'id': 0, 'amount': 1})
+    data['tags'].append(0)
+    serializer = RecipeCreateSerializer(data=data)
+    serializer.is_valid()
+    stdout.write(f'missing ids: {serializer.errors}')
+
+
+@scenario('bulk_cart')
+def bulk_cart_benchmark(stdout, options):
+    author, user = create_users(2)
+    ingredients = create_ingredients(10)
+    recipes = create_recipes(author, ingredients, 50, per_recipe=3)
+    client = get_client(user)
+    for method in ('post', 'delete'):
+        _, queries, elapsed = measure(lambda: [
+            getattr(client, method)(f'/api/recipes/{recipe.id}/shopping_cart/')
+            for recipe in recipes
+        ])
+        stdout.write(
+            f'single {method:<6} recipes={len(recipes)} '
+            f'queries={queries:<4} time={elapsed:.1f}ms'
+        )
+    ids = [recipe.id for recipe in recipes]
+    for method in ('post', 'delete'):
+        response, queries, elapsed = measure(
+            getattr(client, method), '/api/recipes/shopping_cart/bulk/',
+            {'ids': ids}, format='json')
+        stdout.write(
+            f'bulk   {method:<6} recipes={len(ids)} '
+            f'status={response.status_code} queries={queries:<4} '
+            f'time={elapsed:.1f}ms'
+        )
+
+
+SEARCH_DISHES = ('суп', 'салат', 'пирог', 'каша', 'рагу', 'запеканка',
+                 'омлет', 'паста')
+SEARCH_MODIFIERS = ('домашний', 'быстрый', 'овощной', 'сырный', 'грибной',
+                    'рыбный', 'куриный', 'летний')
+SEARCH_INGREDIENTS = ('картофель', 'морковь', 'лук', 'сыр', 'шампиньоны',
+                      'курица', 'рис', 'томаты', 'молоко', 'яйца')
+
+
+@scenario('recipe_search')
+def recipe_search_benchmark(stdout, options):
+    rng = random.Random(0)
+    (author,) = create_users(1)
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'{name} bench', measurement_unit='г')
+        for name in SEARCH_INGREDIENTS
+    )
+    ingredients = list(Ingredient.objects.filter(name__endswith=' bench'))
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author=author,
+                name=(f'{rng.choice(SEARCH_MODIFIERS)} '
+                      f'{rng.choice(SEARCH_DISHES)} {number}'),
+                image='recipes/image/bench.jpg',
+                text=' '.join(rng.choices(
+                    SEARCH_MODIFIERS + SEARCH_DISHES, k=20)),
+                cooking_time=10,
+            ) for number in range(options['recipes'])
+        ),
+        batch_size=1000,
+    )
+    AmountIngredient.objects.bulk_create(
+        (
+            AmountIngredient(recipe_id=recipe_id, ingredient=ingredient,
+                             amount=1)
+            for recipe_id in Recipe.objects.filter(
+                author=author).values_list('pk', flat=True).iterator()
+            for ingredient in rng.sample(ingredients, 3)
+        ),
+        batch_size=1000,
+    )
+    _, _, elapsed = measure(update_search_vectors)
+    stdout.write(
+        f'recipes={options["recipes"]} backend={connection.vendor} '
+        f'vectors={elapsed:.0f}ms'
+    )
+    client = get_client()
+    for query in ('суп', 'сырный пирог', 'шампиньоны', 'несуществующее'):
+        response, queries, elapsed = measure(
+            client.get, '/api/recipes/', {'search': query, 'limit': 6})
+        data = response.json()
+        first = data['results'][0]['name'] if data['results'] else '-'
+        stdout.write(
+            f'query={query:<15} found={data["count"]:<7} '
+            f'first={first:<24} queries={queries} time={elapsed:.1f}ms'
+        )
+
+
+@scenario('recipe_match')
+def recipe_match_benchmark(stdout, options):
+    rng = random.Random(0)
+    (author,) = create_users(1)
+    ingredients = [
+        ingredient.pk for ingredient in create_ingredients(2000)]
+    weights = list(accumulate(
+        1 / (rank + 1) ** 0.8 for rank in range(len(ingredients))))
+    Recipe.objects.bulk_create(
+        (
+            Recipe(author=author, name=f'recipe {number}',
+                   image='recipes/image/bench.jpg', text='bench',
+                   cooking_time=10)
+            for number in range(options['recipes'])
+        ),
+        batch_size=1000,
+    )
+    AmountIngredient.objects.bulk_create(
+        (
+            AmountIngredient(recipe_id=recipe_id, ingredient_id=ingredient,
+                             amount=1)
+            for recipe_id in Recipe.objects.filter(
+                author=author).values_list('pk', flat=True).iterator()
+            for ingredient in set(rng.choices(
+                ingredients, cum_weights=weights, k=rng.randint(4, 12)))
+        ),
+        batch_size=1000,
+    )
+    _, _, elapsed = measure(recipe_matcher.load)
+    stdout.write(
+        f'recipes={len(recipe_matcher.recipes)} '
+        f'ingredients={len(recipe_matcher.masks)} build={elapsed:.0f}ms'
+    )
+    for pantry in (5, 20, 50):
+        timings = []
+        for _ in range(options['repeat']):
+            owned = rng.choices(ingredients, cum_weights=weights, k=pantry)
+            _, _, elapsed = measure(recipe_matcher.match, owned, 20)
+            timings.append(elapsed)
+        stdout.write(
+            f'pantry={pantry:<3} index p50={percentile(timings, 0.5):.1f}ms '
+            f'p95={percentile(timings, 0.95):.1f}ms'
+        )
+    owned = ','.join(map(str, ingredients[:20]))
+    response, queries, elapsed = measure(
+        get_client().get, f'/api/recipes/match/?ingredients={owned}')
+    best = response.json()[0]
+    stdout.write(
+        f'api status={response.status_code} queries={queries} '
+        f'time={elapsed:.1f}ms best coverage={best["coverage"]} '
+        f'missing={best["missing"]}'
+    )
+    recipe = Recipe.objects.filter(author=author).first()
+    AmountIngredient.objects.filter(recipe=recipe).delete()
+    recipe_matcher.publish([recipe.pk])
+    _, queries, elapsed = measure(recipe_matcher.match, ingredients[:5], 20)
+    stdout.write(
+        f'incremental refresh queries={queries} time={elapsed:.1f}ms '
+        f'indexed={recipe.pk in recipe_matcher.recipes}'
+    )
+    recipe_matcher.invalidate()
+
+
+@scenario('token_auth')
+def token_auth_benchmark(stdout, options):
+    (user,) = create_users(1)
+    token = Token.objects.create(user=user)
+    token_cache.invalidate(token.key)
+    for backend in (TokenAuthentication(), CachedTokenAuthentication()):
+        timings = []
+        for _ in range(options['repeat']):
+            _, queries, elapsed = measure(
+                backend.authenticate_credentials, token.key)
+            timings.append(elapsed)
+        stdout.write(
+            f'{type(backend).__name__:<26} queries={queries} '
+            f'p50={percentile(timings, 0.5):.3f}ms'
+        )
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    client.get('/api/tags/')
+    token_cache.invalidate(token.key)
+    for label in ('cold', 'warm'):
+        response, queries, elapsed = measure(client.get, '/api/tags/')
+        stdout.write(
+            f'/api/tags/ {label} status={response.status_code} '
+            f'queries={queries} time={elapsed:.1f}ms'
+        )
+    user.is_active = False
+    user.save()
+    response = client.get('/api/tags/')
+    stdout.write(f'after deactivation status={response.status_code}')
+
+
+LOGIN_HASHERS = (
+    ('pbkdf2 django', 'django.contrib.auth.hashers.PBKDF2PasswordHasher'),
+    ('argon2 tuned', 'users.hashers.TunedArgon2PasswordHasher'),
+    ('bcrypt tuned', 'users.hashers.TunedBCryptSHA256PasswordHasher'),
+)
+
+# Адрес, который тестовый клиент Django подставляет в REMOTE_ADDR.
+LOGIN_ADDRESS = '127.0.0.1'
+
+
+@scenario('login')
+def login_benchmark(stdout, options):
+    (user,) = create_users(1)
+    client = get_client()
+    credentials = {'email': user.email, 'password': BENCH_PASSWORD}
+    for label, hasher in LOGIN_HASHERS:
+        with override_settings(PASSWORD_HASHERS=[hasher]):
+            user.set_password(BENCH_PASSWORD)
+            user.save()
+            start = perf_counter()
+            for _ in range(options['repeat']):
+                response = client.post('/api/auth/token/login/', credentials)
+            elapsed = perf_counter() - start
+        stdout.write(
+            f'{label:<14} status={response.status_code} '
+            f'logins/s={options["repeat"] / elapsed:.1f}'
+        )
+    with override_settings(PASSWORD_HASHERS=[LOGIN_HASHERS[0][1]]):
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+    client.post('/api/auth/token/login/', credentials)
+    user.refresh_from_db()
+    stdout.write(f'rehash on login: {user.password.split("$")[0]}')
+    login_failures.reset(user.email, LOGIN_ADDRESS)
+    wrong = {'email': user.email, 'password': 'wrong-password'}
+    for attempt in range(settings.LOGIN_FAILURE_LIMIT + 20):
+        response, _, elapsed = measure(
+            client.post, '/api/auth/token/login/', wrong)
+        if attempt in (0, settings.LOGIN_FAILURE_LIMIT):
+            stdout.write(
+                f'failed attempt {attempt + 1:<3} '
+                f'status={response.status_code} time={elapsed:.1f}ms'
+            )
+    response = client.post(
+        '/api/auth/token/login/', credentials, REMOTE_ADDR='10.0.0.2')
+    stdout.write(f'other address status={response.status_code}')
+    login_failures.reset(user.email, LOGIN_ADDRESS)
+
+
+@scenario('conditional_get')
+def conditional_get_benchmark(stdout, options):
+    author, user = create_users(2)
+    ingredients = create_ingredients(50)
+    recipes = create_recipes(author, ingredients, 100)
+    for client_user in (None, user):
+        client = get_client(client_user)
+        for url in ('/api/recipes/?limit=100',
+                    f'/api/recipes/{recipes[0].id}/'):
+            response, queries, elapsed = measure(client.get, url)
+            cached, cached_queries, cached_elapsed = measure(
+                client.get, url, HTTP_IF_NONE_MATCH=response['ETag'])
+            stdout.write(
+                f'user={"auth" if client_user else "anon"} {url:<25} '
+                f'full={elapsed:.1f}ms ({queries} queries) '
+                f'revalidate={cached.status_code} {cached_elapsed:.1f}ms '
+                f'({cached_queries} queries)'
+            )
+
+
+def feed_cache_results():
+    return {
+        dict(labels)['result']: value
+        for (name, labels), value in registry.counters.items()
+        if name == feed_cache.metric
+    }
+
+
+@scenario('feed_cache')
+def feed_cache_benchmark(stdout, options):
+    author, = create_users(1)
+    ingredients = create_ingredients(50)
+    recipes = create_recipes(author, ingredients, options['recipes'])
+    tag = Tag.objects.create(name='Лента', color='#00FF00', slug='feed')
+    tag.recipes.add(*recipes[::2])
+    client = get_client(None)
+    urls = ('/api/recipes/', '/api/recipes/?page=2',
+            '/api/recipes/?tags=feed&limit=12')
+    before = feed_cache_results()
+    for url in urls:
+        response, queries, elapsed = measure(client.get, url)
+        timings = []
+        for _ in range(options['repeat']):
+            cached, cached_queries, cached_elapsed = measure(client.get, url)
+            timings.append(cached_elapsed)
+        assert cached.content == response.content
+        stdout.write(
+            f'{url:<35} cold={elapsed:.1f}ms ({queries} queries) '
+            f'cached={sum(timings) / len(timings):.2f}ms '
+            f'({cached_queries} queries)'
+        )
+    recipes[0].save()
+    response, queries, elapsed = measure(client.get, urls[0])
+    stdout.write(
+        f'после изменения рецепта: {elapsed:.1f}ms ({queries} queries)')
+    results = {
+        result: value - before.get(result, 0)
+        for result, value in feed_cache_results().items()
+    }
+    total = sum(results.values())
+    stdout.write(
+        f'доля попаданий: {results.get("hit", 0) / total:.0%} {results}')
+
+
+@scenario('json_render')
+def json_render_benchmark(stdout, options):
+    author, = create_users(1)
+    ingredients = create_ingredients(50)
+    recipes = create_recipes(author, ingredients, 100)
+    Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]).update(
+        name='Борщ с пампушками', text='Свёкла, капуста, картофель')
+    tag = Tag.objects.create(name='Обед', color='#FF0000', slug='lunch')
+    tag.recipes.add(*recipes)
+    data = get_client(author).get('/api/recipes/?limit=100').data
+    body = JSONRenderer().render(data)
+    assert ORJSONRenderer().render(data) == body
+    payload = JSONRenderer().render({
+        'tags': [tag.id],
+        'ingredients': [
+            {'id': ingredient.id, 'amount': 10} for ingredient in ingredients
+        ],
+        'name': 'Борщ',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': png_base64(512),
+    })
+    assert ORJSONParser().parse(BytesIO(payload)) == JSONParser().parse(
+        BytesIO(payload))
+    for name, func, argument in (
+        ('render stdlib', JSONRenderer().render, data),
+        ('render orjson', ORJSONRenderer().render, data),
+        ('parse stdlib', lambda body: JSONParser().parse(BytesIO(body)),
+         payload),
+        ('parse orjson', lambda body: ORJSONParser().parse(BytesIO(body)),
+         payload),
+    ):
+        timings = [
+            measure(func, argument)[2] for _ in range(options['repeat'])
+        ]
+        stdout.write(
+            f'{name:<14} {sum(timings) / len(timings):.2f}ms '
+            f'p95={percentile(timings, 0.95):.2f}ms'
+        )
+    escaped = json.dumps(data, cls=JSONEncoder, separators=(',', ':'))
+    stdout.write(
+        f'страница 100 рецептов: {len(body)} байт, '
+        f'с ensure_ascii {len(escaped.encode())} байт; '
+        f'тело создания рецепта: {len(payload)} байт'
+    )
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def get_endpoint_requests(user, author, recipe, tag, ingredient, image):
+    """Запросы ко всем маршрутам api/urls.py в порядке выполнения."""
+    state = {'users': 0}
+    recipe_data = {
+        'tags': [tag.id],
+        'ingredients': [{'id': ingredient.id, 'amount': 10}],
+        'name': 'Нагрузочный рецепт',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': image,
+    }
+
+    def new_user():
+        state['users'] += 1
+        return {
+            'email': f'bench-new{state["users"]}@example.com',
+            'username': f'bench-new{state["users"]}',
+            'first_name': 'Bench',
+            'last_name': 'User',
+            'password': 'bench-load-password',
+        }
+
+    def created_recipe():
+        return f'/api/recipes/{state["recipe"]}/'
+
+    bulk_data = {
+        'ids': list(author.recipes.values_list('id', flat=True)[:10]),
+    }
+
+    def remember_recipe(response):
+        state['recipe'] = response.json()['id']
+
+    return (
+        ('users list', 'get', '/api/users/', None),
+        ('users detail', 'get', f'/api/users/{author.id}/', None),
+        ('users me', 'get', '/api/users/me/', None),
+        ('users create', 'post', '/api/users/', new_user),
+        ('users set_password', 'post', '/api/users/set_password/', {
+            'current_password': BENCH_PASSWORD,
+            'new_password': BENCH_PASSWORD,
+        }),
+        ('subscriptions', 'get', '/api/users/subscriptions/', None),
+        ('subscribe', 'post', f'/api/users/{author.id}/subscribe/', None),
+        ('unsubscribe', 'delete', f'/api/users/{author.id}/subscribe/',
+         None),
+        ('tags list', 'get', '/api/tags/', None),
+        ('tags detail', 'get', f'/api/tags/{tag.id}/', None),
+        ('ingredients search', 'get', '/api/ingredients/?name=bench', None),
+        ('ingredients detail', 'get', f'/api/ingredients/{ingredient.id}/',
+         None),
+        ('recipes list', 'get', '/api/recipes/', None),
+        ('recipes by tag', 'get', f'/api/recipes/?tags={tag.slug}', None),
+        ('recipes by author', 'get', f'/api/recipes/?author={author.id}',
+         None),
+        ('recipes favorited', 'get', '/api/recipes/?is_favorited=1', None),
+        ('recipes cursor', 'get', '/api/recipes/?cursor=', None),
+        ('recipes detail', 'get', f'/api/recipes/{recipe.id}/', None),
+        ('recipes match', 'get',
+         f'/api/recipes/match/?ingredients={ingredient.id}', None),
+        ('recipes create', 'post', '/api/recipes/', recipe_data,
+         remember_recipe),
+        ('recipes update', 'patch', created_recipe, recipe_data),
+        ('favorite add', 'post', created_recipe, None, 'favorite/'),
+        ('favorite remove', 'delete', created_recipe, None, 'favorite/'),
+        ('cart add', 'post', created_recipe, None, 'shopping_cart/'),
+        ('cart download', 'get',
+         '/api/recipes/download_shopping_cart/', None),
+        ('cart remove', 'delete', created_recipe, None, 'shopping_cart/'),
+        ('cart bulk add', 'post', '/api/recipes/shopping_cart/bulk/',
+         bulk_data),
+        ('cart bulk remove', 'delete', '/api/recipes/shopping_cart/bulk/',
+         bulk_data),
+        ('favorite bulk add', 'post', '/api/recipes/favorite/bulk/',
+         bulk_data),
+        ('favorite bulk remove', 'delete', '/api/recipes/favorite/bulk/',
+         bulk_data),
+        ('recipes delete', 'delete', created_recipe, None),
+        ('token login', 'post', '/api/auth/token/login/', {
+            'email': user.email, 'password': BENCH_PASSWORD,
+        }),
+        ('token logout', 'post', '/api/auth/token/logout/', None),
+    )
+
+
+def run_endpoint_requests(client, requests, repeat):
+    results = defaultdict(list)
+    for _ in range(repeat):
+        for label, method, url, data, *extra in requests:
+            if callable(url):
+                url = url()
+            if extra and isinstance(extra[0], str):
+                url += extra[0]
+            if callable(data):
+                data = data()
+            response, queries, elapsed = measure(
+                getattr(client, method), url, data, format='json')
+            if extra and callable(extra[0]):
+                extra[0](response)
+            results[label].append((elapsed, queries, response.status_code))
+    return results
+
+
+@scenario('endpoints')
+def endpoints_benchmark(stdout, options):
+    ingredients = create_ingredients(300)
+    Tag.objects.bulk_create(
+        Tag(name=f'bench tag {number}', color=f'#bench{number}',
+            slug=f'bench-tag-{number}')
+        for number in range(3)
+    )
+    call_command(
+        'seed_load', users=options['users'], recipes=options['recipes'],
+        prefix='bench-load', password=BENCH_PASSWORD, stdout=stdout)
+    user = User.objects.get(username='bench-load0')
+    author = Recipe.objects.filter(
+        author__username__startswith='bench-load').first().author
+    Follow.objects.filter(user=user, author=author).delete()
+    recipe = author.recipes.first()
+    tag = recipe.tags.first()
+    requests = get_endpoint_requests(
+        user, author, recipe, tag, ingredients[0], png_base64())
+    client = get_client(user)
+    admin, = create_users(1, prefix='bench-admin')
+    admin.is_staff = True
+    admin.save(update_fields=['is_staff'])
+    with TemporaryDirectory() as media_root:
+        with override_settings(MEDIA_ROOT=media_root, API_METRICS=True):
+            results = run_endpoint_requests(
+                client, requests, options['repeat'])
+            results.update(run_endpoint_requests(
+                get_client(admin),
+                (('metrics', 'get', '/api/_metrics', None),),
+                options['repeat']))
+    stdout.write(
+        f'{"endpoint":<20} {"p50 ms":>8} {"p95 ms":>8} {"queries":>8} status')
+    for label, measurements in results.items():
+        timings = [elapsed for elapsed, _, _ in measurements]
+        queries = max(queries for _, queries, _ in measurements)
+        statuses = ','.join(sorted({str(code) for *_, code in measurements}))
+        stdout.write(
+            f'{label:<20} {percentile(timings, 0.5):>8.1f} '
+            f'{percentile(timings, 0.95):>8.1f} {queries:>8} {statuses}'
+        )
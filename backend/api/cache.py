@@ -0,0 +1,328 @@
+from collections import OrderedDict
+from hashlib import md5
+from threading import Lock
+from time import sleep, time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, parse_http_date, quote_etag
+from rest_framework import status
+from rest_framework.mixins import ListModelMixin
+from rest_framework.response import Response
+
+from api.metrics import registry
+
+
+class ReferenceCache:
+    """Двухуровневый кэш справочников: LRU в процессе и общий кэш Django.
+
+    Версия каждого справочника хранится в общем кэше и входит в ключ,
+    поэтому после её смены все воркеры перестают видеть старые записи.
+    """
+
+    def __init__(self, alias, size, timeout):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.lock = Lock()
+        self.local = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def get_version(self, namespace):
+        key = f'reference:{namespace}:version'
+        version = self.shared.get(key)
+        if version is None:
+            self.shared.add(key, uuid4().hex, None)
+            version = self.shared.get(key)
+        return version
+
+    def invalidate(self, namespace):
+        self.shared.set(f'reference:{namespace}:version', uuid4().hex, None)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.local:
+                self.local.move_to_end(key)
+                return self.local[key]
+        entry = self.shared.get(key)
+        if entry is not None:
+            self.set_local(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self.shared.set(key, entry, self.timeout)
+        self.set_local(key, entry)
+
+    def set_local(self, key, entry):
+        with self.lock:
+            self.local[key] = entry
+            self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+
+reference_cache = ReferenceCache(
+    alias=settings.REFERENCE_CACHE_ALIAS,
+    size=settings.REFERENCE_CACHE_SIZE,
+    timeout=settings.REFERENCE_CACHE_TIMEOUT,
+)
+
+
+class ReferenceCacheMixin:
+    """Кэширует list и retrieve справочника с поддержкой If-None-Match."""
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request, version, **kwargs):
+        params = sorted(request.query_params.lists())
+        digest = md5(f'{self.action}:{kwargs}:{params}'.encode()).hexdigest()
+        return f'reference:{self.cache_namespace}:{version}:{digest}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        version = reference_cache.get_version(self.cache_namespace)
+        key = self.get_cache_key(request, version, **kwargs)
+        entry = reference_cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = quote_etag(md5(key.encode()).hexdigest())
+            entry = (etag, response.data)
+            reference_cache.set(key, entry)
+        etag, data = entry
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+
+
+def user_state_namespace(user_id):
+    """Версия избранного, корзины и подписок пользователя."""
+    return f'user-state:{user_id}'
+
+
+class ConditionalRecipeMixin:
+    """ETag, Last-Modified и Cache-Control для списка и карточки рецепта.
+
+    Валидатор строится из версий рецептов, тегов, ингредиентов
+    и профилей, а для авторизованного пользователя - ещё и версии его
+    избранного, корзины и подписок, поэтому список проверяется без
+    запросов к базе. Карточка дополнительно учитывает updated_at
+    рецепта и отдаёт его анониму как Last-Modified. Совпавший валидатор
+    даёт 304 без сериализации. Порядок ordering=popular зависит
+    от счётчиков избранного, которые не меняют версий, поэтому такой
+    список отдаётся без валидатора.
+    """
+
+    shared_namespaces = ('recipes', 'tags', 'ingredients', 'profiles')
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.queryset.filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        return self.conditional_response(
+            super().retrieve, request, *args, queryset=queryset, **kwargs)
+
+    def get_state_versions(self, request):
+        namespaces = list(self.shared_namespaces)
+        if request.user.is_authenticated:
+            namespaces.append(user_state_namespace(request.user.pk))
+        return [reference_cache.get_version(name) for name in namespaces]
+
+    def get_validators(self, request, queryset=None, **kwargs):
+        """ETag и Last-Modified ответа или None, если проверять нечем."""
+        if request.query_params.get('ordering') == 'popular':
+            return None, None
+        updated = last_modified = None
+        if queryset is not None:
+            updated = queryset.values_list('updated_at', flat=True).first()
+            if updated is None:
+                return None, None
+            if not request.user.is_authenticated:
+                last_modified = int(updated.timestamp())
+        params = sorted(request.query_params.lists())
+        etag = quote_etag(md5(
+            f'{self.action}:{kwargs}:{params}:{updated}:'
+            f'{self.get_state_versions(request)}'.encode()
+        ).hexdigest())
+        return etag, last_modified
+
+    def add_cache_headers(self, response, request, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        if not request.user.is_authenticated:
+            patch_cache_control(
+                response, public=True, max_age=settings.RECIPE_CACHE_MAX_AGE)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization',))
+
+    def conditional_response(self, handler, request, *args, queryset=None,
+                             **kwargs):
+        etag, last_modified = self.get_validators(
+            request, queryset, **kwargs)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        self.add_cache_headers(response, request, etag, last_modified)
+        return response
+
+
+class FeedCache:
+    """Общий кэш готовых ответов с защитой от одновременной пересборки.
+
+    Запись свежа timeout секунд и хранится ещё столько же. Пересобирает
+    её только воркер, взявший блокировку через cache.add, остальные
+    отдают устаревшую запись, а если её нет - ждут до wait секунд.
+    """
+
+    metric = 'foodgram_recipe_feed_cache_total'
+    poll_interval = 0.05
+
+    def __init__(self, alias, timeout, lock_timeout, wait):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def build(self, key, builder):
+        entry = builder()
+        if entry['status'] == status.HTTP_200_OK:
+            entry['fresh_until'] = time() + self.timeout
+            self.shared.set(key, entry, self.timeout * 2)
+        return entry
+
+    def get_or_build(self, key, builder):
+        entry = self.shared.get(key)
+        if entry is not None and entry['fresh_until'] > time():
+            registry.inc(self.metric, result='hit')
+            return entry
+        lock = f'{key}:lock'
+        if self.shared.add(lock, 1, self.lock_timeout):
+            try:
+                entry = self.build(key, builder)
+            finally:
+                self.shared.delete(lock)
+            registry.inc(self.metric, result='miss')
+            return entry
+        if entry is not None:
+            registry.inc(self.metric, result='stale')
+            return entry
+        deadline = time() + self.wait
+        while time() < deadline:
+            sleep(self.poll_interval)
+            entry = self.shared.get(key)
+            if entry is not None:
+                registry.inc(self.metric, result='wait')
+                return entry
+        registry.inc(self.metric, result='miss')
+        return builder()
+
+
+feed_cache = FeedCache(
+    alias=settings.REFERENCE_CACHE_ALIAS,
+    timeout=settings.RECIPE_FEED_CACHE_TIMEOUT,
+    lock_timeout=settings.RECIPE_FEED_CACHE_LOCK_TIMEOUT,
+    wait=settings.RECIPE_FEED_CACHE_WAIT,
+)
+
+
+class RecipeFeedCacheMixin:
+    """Кэш отрендеренного списка рецептов для анонимных JSON-запросов.
+
+    Ключ строится из адреса, нормализованных параметров и версий
+    рецептов, тегов, ингредиентов и профилей. Вместе с телом хранятся
+    ETag и Last-Modified, так что попадание в кэш не обращается к базе.
+    """
+
+    feed_flags = ('cursor',)
+    feed_headers = ('Content-Type', 'ETag', 'Last-Modified',
+                    'Cache-Control', 'Vary')
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_feed_cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        entry = feed_cache.get_or_build(
+            key, lambda: self.build_feed_entry(request, *args, **kwargs))
+        headers = entry['headers']
+        last_modified = headers.get('Last-Modified')
+        response = get_conditional_response(
+            request, etag=headers.get('ETag'),
+            last_modified=last_modified and parse_http_date(last_modified))
+        if response is None:
+            response = HttpResponse(entry['content'], status=entry['status'])
+        for header, value in headers.items():
+            if header != 'Content-Type' or response.status_code != 304:
+                response[header] = value
+        return response
+
+    def get_feed_cache_key(self, request):
+        if (request.user.is_authenticated
+                or request.accepted_renderer.format != 'json'):
+            return None
+        # Пустой cursor включает курсорную пагинацию, поэтому
+        # он остаётся в ключе, а прочие пустые параметры отбрасываются.
+        params = sorted(
+            (key, sorted(value for value in values if value))
+            for key, values in request.query_params.lists()
+            if key != 'format' and (any(values) or key in self.feed_flags)
+        )
+        if ('page', ['1']) in params:
+            params.remove(('page', ['1']))
+        versions = [
+            reference_cache.get_version(name)
+            for name in self.shared_namespaces
+        ]
+        digest = md5(
+            f'{request.build_absolute_uri(request.path)}:{params}:'
+            f'{versions}'.encode()
+        ).hexdigest()
+        return f'recipe-feed:{digest}'
+
+    def build_feed_entry(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, **kwargs)
+        response = ListModelMixin.list(self, request, *args, **kwargs)
+        if etag is not None:
+            self.add_cache_headers(response, request, etag, last_modified)
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        return {
+            'status': response.status_code,
+            'content': response.content,
+            'headers': {
+                header: response[header]
+                for header in self.feed_headers if response.has_header(header)
+            },
+        }
@@ -0,0 +1,126 @@
+import base64
+import binascii
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение рецепта в base64.
+
+    Размер проверяется до декодирования, декодирование идёт частями во
+    временный файл, а размеры картинки читаются из заголовка. В ответе
+    отдаётся ссылка на уменьшенную копию, если она уже готова.
+    """
+
+    chunk_size = 4 * 64 * 1024
+    formats = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+    def __init__(self, *args, variant=None, list_variant=None, **kwargs):
+        self.variant = variant
+        self.list_variant = list_variant or variant
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        payload = base64_data.rpartition(';base64,')[2]
+        if len(payload) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(
+                'Размер изображения не должен превышать '
+                f'{settings.RECIPE_IMAGE_MAX_SIZE // (1024 * 1024)} МБ.')
+        file = SpooledTemporaryFile(max_size=1024 * 1024)
+        try:
+            for start in range(0, len(payload), self.chunk_size):
+                file.write(base64.b64decode(
+                    payload[start:start + self.chunk_size]))
+            file.seek(0)
+            image = Image.open(file)
+            width, height = image.size
+            image_format = image.format
+            image.verify()
+        except (binascii.Error, ValueError, OSError):
+            file.close()
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if image_format not in self.formats:
+            file.close()
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            file.close()
+            raise serializers.ValidationError(
+                f'Слишком большое изображение: {width}x{height}.')
+        size = file.seek(0, 2)
+        file.seek(0)
+        return UploadedFile(
+            file=file,
+            name=f'{uuid.uuid4()}.{self.formats[image_format]}',
+            content_type=Image.MIME.get(image_format),
+            size=size,
+        )
+
+    def to_representation(self, file):
+        variant = self.variant
+        if isinstance(getattr(self.parent, 'parent', None),
+                      serializers.ListSerializer):
+            variant = self.list_variant
+        name = file and file.instance.image_variants.get(variant)
+        if not name:
+            return super().to_representation(file)
+        url = file.storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список первичных ключей, загружаемый одним in_bulk."""
+
+    default_error_messages = {
+        'does_not_exist': 'Объекты с id {pk_values} не существуют.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pk_field = self.child_relation.get_queryset().model._meta.pk
+        pk_values = []
+        for item in data:
+            if isinstance(item, bool):
+                self.child_relation.fail(
+                    'incorrect_type', data_type=type(item).__name__)
+            try:
+                pk_values.append(pk_field.to_python(item))
+            except Exception:
+                self.child_relation.fail(
+                    'incorrect_type', data_type=type(item).__name__)
+        objects = self.child_relation.get_queryset().in_bulk(pk_values)
+        missing = [pk for pk in dict.fromkeys(pk_values) if pk not in objects]
+        if missing:
+            self.fail(
+                'does_not_exist',
+                pk_values=', '.join(str(pk) for pk in missing))
+        return [objects[pk] for pk in pk_values]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который при many=True не делает
+    отдельный запрос на каждый id."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
@@ -1,15 +1,28 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import (BooleanField, Case, Exists, F, IntegerField,
+                              OuterRef, Q, Value, When)
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
 
 
 class IngredientFilters(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
+    name = filters.CharFilter(method='name_filter')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def name_filter(self, queryset, name, value):
+        return queryset.filter(name__icontains=value).annotate(
+            is_infix=Case(
+                When(name__istartswith=value, then=Value(False)),
+                default=Value(True),
+                output_field=BooleanField(),
+            )
+        ).order_by('is_infix', 'name')
+
 
 class RecipeFilters(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
@@ -23,20 +36,52 @@ class RecipeFilters(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter'
     )
+    search = filters.CharFilter(method='search_filter')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='ordering_filter'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
 
     def is_favorited_filter(self, queryset, name, value):
-        if value:
-            return queryset.filter(favorites__user=self.request.user)
-        return queryset.exclude(
-            favorites__user=self.request.user
-        )
+        return queryset.filter(is_favorited=value)
 
     def is_in_shopping_cart_filter(self, queryset, name, value):
-        if value:
-            return Recipe.objects.filter(
-                shopping_list__user=self.request.user
+        return queryset.filter(is_in_shopping_cart=value)
+
+    def search_filter(self, queryset, name, value):
+        """Полнотекстовый поиск: название важнее ингредиентов и описания.
+
+        В PostgreSQL ищет по Recipe.search_vector с ранжированием,
+        в остальных базах - по icontains с тем же порядком весов.
+        """
+        if connection.vendor == 'postgresql':
+            from django.contrib.postgres.search import SearchQuery, SearchRank
+            query = SearchQuery(
+                value, config=settings.RECIPE_SEARCH_CONFIG,
+                search_type='websearch')
+            return queryset.filter(search_vector__matches=query).annotate(
+                rank=SearchRank(F('search_vector'), query)
+            ).order_by('-rank', '-pub_date', '-id')
+        return queryset.annotate(
+            has_ingredient=Exists(AmountIngredient.objects.filter(
+                recipe=OuterRef('pk'), ingredient__name__icontains=value))
+        ).filter(
+            Q(name__icontains=value)
+            | Q(has_ingredient=True)
+            | Q(text__icontains=value)
+        ).annotate(
+            rank=Case(
+                When(name__icontains=value, then=Value(3)),
+                When(has_ingredient=True, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
             )
+        ).order_by('-rank', '-pub_date', '-id')
+
+    def ordering_filter(self, queryset, name, value):
+        return queryset.order_by('-favorites_count', '-pub_date', '-id')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.benchmarks import SCENARIOS, reset_caches
+
+
+class Command(BaseCommand):
+    help = ('Запускает сценарии производительности API. '
+            'Все созданные данные откатываются после прогона.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*',
+            help=f'Сценарии: {", ".join(sorted(SCENARIOS))}')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Количество повторов в сценарии endpoints')
+        parser.add_argument(
+            '--users', type=int, default=200,
+            help='Пользователей в данных сценария endpoints')
+        parser.add_argument(
+            '--recipes', type=int, default=2000,
+            help='Рецептов в данных сценариев endpoints и recipe_search')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            reset_caches()
+            with transaction.atomic():
+                SCENARIOS[name](self.stdout, options)
+                transaction.set_rollback(True)
+        reset_caches()
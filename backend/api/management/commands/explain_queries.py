@@ -0,0 +1,95 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.benchmarks import create_ingredients, create_recipes, create_users
+from recipes import carts
+from recipes.models import (FavoriteRecipe, Recipe, ShoppingCartIngredient,
+                            ShoppingList, Tag)
+from users.models import Follow, User
+
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def get_queries(user, author, tag):
+    recipes = Recipe.objects.add_user_annotations(user)
+    return {
+        'recipes': recipes[:6],
+        'recipes by author': recipes.filter(author=author)[:6],
+        'recipes by tag': recipes.filter(tags__slug=tag.slug).distinct()[:6],
+        'favorited recipes': recipes.filter(is_favorited=True)[:6],
+        'recipes in shopping cart': recipes.filter(
+            is_in_shopping_cart=True)[:6],
+        'subscriptions': User.objects.filter(
+            following__user=user).order_by('id')[:6],
+        'shopping cart export': ShoppingCartIngredient.objects.filter(
+            user=user
+        ).values(
+            'ingredient__name', 'ingredient__measurement_unit', 'total'
+        ).order_by('ingredient__name'),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN ANALYZE для основных запросов ленты '
+            'и завершается ошибкой, если план содержит Seq Scan.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--authors', type=int, default=200,
+            help='Количество авторов в тестовых данных')
+        parser.add_argument(
+            '--recipes', type=int, default=50,
+            help='Количество рецептов у каждого автора')
+        parser.add_argument(
+            '--allow', nargs='*', default=['recipes_tag'],
+            help='Таблицы, для которых Seq Scan допустим')
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы целиком')
+
+    def seed(self, authors_count, recipes_count):
+        users = create_users(authors_count + 1, prefix='explain')
+        user, authors = users[0], users[1:]
+        ingredients = create_ingredients(500, prefix='explain ingredient')
+        tag = Tag.objects.create(
+            name='explain tag', color='#explain', slug='explain-tag')
+        recipes = []
+        for author in authors:
+            recipes += create_recipes(author, ingredients, recipes_count)
+        tag.recipes.add(*recipes[::7])
+        Follow.objects.bulk_create(
+            Follow(user=user, author=author) for author in authors[::10])
+        FavoriteRecipe.objects.bulk_create(
+            FavoriteRecipe(user=user, recipe=recipe)
+            for recipe in recipes[::50])
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=user, recipe=recipe)
+            for recipe in recipes[::500])
+        carts.rebuild([user.pk])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return user, authors[0], tag
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Команда работает только с PostgreSQL.')
+        failures = []
+        with transaction.atomic():
+            user, author, tag = self.seed(
+                options['authors'], options['recipes'])
+            for name, queryset in get_queries(user, author, tag).items():
+                plan = queryset.explain(analyze=True)
+                tables = set(SEQ_SCAN.findall(plan)) - set(options['allow'])
+                if tables:
+                    failures.append(f'{name}: {", ".join(sorted(tables))}')
+                    self.stdout.write(self.style.ERROR(f'{name}: Seq Scan'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+                if options['verbose_plans'] or tables:
+                    self.stdout.write(plan)
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                'Seq Scan в планах запросов:\n' + '\n'.join(failures))
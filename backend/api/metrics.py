@@ -0,0 +1,78 @@
+from collections import defaultdict
+from threading import Lock
+from time import perf_counter
+
+METRICS = {
+    'foodgram_requests_total': 'Количество запросов',
+    'foodgram_request_duration_seconds_total': 'Суммарное время ответа',
+    'foodgram_db_queries_total': 'Количество SQL-запросов',
+    'foodgram_db_duration_seconds_total': 'Суммарное время SQL-запросов',
+    'foodgram_app_duration_seconds_total': (
+        'Время приложения без SQL, сериализации и рендеринга'),
+    'foodgram_serializer_duration_seconds_total': (
+        'Время сериализации ответа без SQL'),
+    'foodgram_render_duration_seconds_total': 'Время рендеринга ответа',
+    'foodgram_response_bytes_total': 'Суммарный размер ответов',
+    'foodgram_n_plus_one_total': 'Запросы с повторяющимися SQL-шаблонами',
+    'foodgram_recipe_feed_cache_total': (
+        'Обращения к кэшу ленты рецептов по результату'),
+}
+
+
+class MetricsRegistry:
+    """Счётчики Prometheus в памяти процесса."""
+
+    def __init__(self, descriptions):
+        self.descriptions = dict(descriptions)
+        self.lock = Lock()
+        self.counters = defaultdict(float)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def export(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+        lines = []
+        current = None
+        for (name, labels), value in counters:
+            if name != current:
+                current = name
+                description = self.descriptions.get(name, name)
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} counter')
+            label_text = ','.join(
+                f'{key}="{label}"' for key, label in labels)
+            if label_text:
+                label_text = f'{{{label_text}}}'
+            lines.append(f'{name}{label_text} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(METRICS)
+
+
+class SerializerTimingMixin:
+    """Копит в запросе время to_representation верхнего уровня без SQL.
+
+    Вложенные сериализаторы и вызовы .data внутри полей не считаются
+    повторно. Работает, только когда запрос прошёл через
+    QueryMetricsMiddleware.
+    """
+
+    def to_representation(self, instance):
+        request = getattr(self.context.get('request'), '_request', None)
+        recorder = getattr(request, 'metrics_recorder', None)
+        if recorder is None or request.metrics_serializing:
+            return super().to_representation(instance)
+        request.metrics_serializing = True
+        start = perf_counter()
+        db_start = recorder.duration
+        try:
+            return super().to_representation(instance)
+        finally:
+            request.metrics_serializing = False
+            request.metrics_serialize += (
+                perf_counter() - start - (recorder.duration - db_start))
@@ -0,0 +1,114 @@
+import logging
+from collections import Counter
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from api.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+            self.templates[sql] += 1
+
+
+class QueryMetricsMiddleware:
+    """Считает SQL-запросы и время ответа по представлениям DRF.
+
+    Результаты отдаются в заголовке Server-Timing и копятся в счётчиках
+    для /api/_metrics. Повтор одного SQL-шаблона не меньше
+    API_METRICS_N_PLUS_ONE_THRESHOLD раз за запрос считается N+1.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request.metrics_view = None
+        request.metrics_render = 0
+        request.metrics_recorder = recorder
+        request.metrics_serialize = 0
+        request.metrics_serializing = False
+        start = perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = perf_counter() - start
+        if request.metrics_view is not None:
+            self.record(request, response, recorder, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', None)
+        if view is None:
+            request.metrics_view = view_func.__name__
+            return
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        request.metrics_view = f'{view.__name__}.{action}'
+
+    def process_template_response(self, request, response):
+        start = perf_counter()
+
+        def finish_render(response):
+            request.metrics_render = perf_counter() - start
+
+        response.add_post_render_callback(finish_render)
+        return response
+
+    def record(self, request, response, recorder, total):
+        view = request.metrics_view
+        render = request.metrics_render
+        serialize = request.metrics_serialize
+        app = max(total - recorder.duration - render - serialize, 0)
+        size = 0 if response.streaming else len(response.content)
+        duplicates = {
+            sql: count for sql, count in recorder.templates.items()
+            if count >= settings.API_METRICS_N_PLUS_ONE_THRESHOLD
+        }
+        registry.inc('foodgram_requests_total', view=view)
+        registry.inc(
+            'foodgram_request_duration_seconds_total', total, view=view)
+        registry.inc('foodgram_db_queries_total', recorder.count, view=view)
+        registry.inc(
+            'foodgram_db_duration_seconds_total', recorder.duration,
+            view=view)
+        registry.inc('foodgram_app_duration_seconds_total', app, view=view)
+        registry.inc(
+            'foodgram_serializer_duration_seconds_total', serialize,
+            view=view)
+        registry.inc(
+            'foodgram_render_duration_seconds_total', render, view=view)
+        registry.inc('foodgram_response_bytes_total', size, view=view)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries"',
+            f'app;dur={app * 1000:.1f}',
+            f'serialize;dur={serialize * 1000:.1f}',
+            f'render;dur={render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        if duplicates:
+            registry.inc('foodgram_n_plus_one_total', view=view)
+            response['X-Query-Duplicates'] = str(sum(duplicates.values()))
+            for sql, count in duplicates.items():
+                logger.warning('Возможный N+1 в %s: %s раз %s',
+                               view, count, sql)
@@ -1,6 +1,50 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(RecipeCursorPagination):
+    ordering = ('id',)
+
+
+class OptionalCursorPagination(LimitPageNumberPagination):
+    """Постраничная пагинация с переходом на курсорную по ?cursor=.
+
+    Без параметра cursor ответ прежний: page, limit и count. С ним
+    (в том числе пустым для первой страницы) выборка идёт по ключу
+    без OFFSET и COUNT(*), а ответ содержит только next и previous.
+    Выборка, уже упорядоченная иначе (поиск, ordering=popular), всегда
+    делится по страницам: курсор потерял бы её порядок.
+    """
+
+    cursor_pagination_class = RecipeCursorPagination
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_query_param = self.cursor_pagination_class.cursor_query_param
+        ordering = tuple(queryset.query.order_by)
+        if (cursor_query_param not in request.query_params
+                or ordering and ordering
+                != self.cursor_pagination_class.ordering):
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = self.cursor_pagination_class()
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is None:
+            return super().get_paginated_response(data)
+        return self.cursor_paginator.get_paginated_response(data)
+
+
+class OptionalSubscriptionCursorPagination(OptionalCursorPagination):
+    cursor_pagination_class = SubscriptionCursorPagination
@@ -0,0 +1,29 @@
+import codecs
+from io import BytesIO
+
+import orjson
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from api.renderers import ORJSONRenderer
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser на orjson.
+
+    Тело не в UTF-8 и тело, которое orjson не разобрал, передаются
+    родительскому классу, поэтому сообщения об ошибках не меняются.
+    """
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        if codecs.lookup(encoding).name == 'utf-8':
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(BytesIO(body), media_type, parser_context)
@@ -0,0 +1,155 @@
+import csv
+from io import BytesIO
+
+import orjson
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """Формат списка покупок выбирается только параметром ?format=."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE)
+        if format_query:
+            return super().select_renderer(request, renderers, format_suffix)
+        return renderers[0], renderers[0].media_type
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson с тем же выводом.
+
+    Словари, списки, строки и числа orjson пишет сам, остальное (даты,
+    Decimal, ленивые строки) уходит в encoder_class, как и в stdlib.
+    Отступы, экранирование не-ASCII, NaN и значения, которые orjson
+    не умеет записать, обрабатывает родительский класс.
+    """
+
+    options = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact or not self.strict
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace('\u2029'.encode(), b'\\u2029')
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data).encode(self.charset)
+
+
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер выгрузки списка покупок.
+
+    Сам список отдаётся по частям через stream(), а render()
+    используется только для ответов с ошибками.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data or '').encode(self.charset)
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for item in ingredients:
+            yield (
+                f"{item['ingredient__name']} - {item['total']} "
+                f"{item['ingredient__measurement_unit']},\n"
+            ).encode(self.charset)
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        ).encode(self.charset)
+        for item in ingredients:
+            yield writer.writerow((
+                item['ingredient__name'],
+                item['total'],
+                item['ingredient__measurement_unit'],
+            )).encode(self.charset)
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    line_height = 18
+    margin = 50
+    chunk_size = 64 * 1024
+
+    def get_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_FONT))
+        return self.font_name
+
+    def stream(self, ingredients):
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        width, height = A4
+        pdf.setFont(font, self.font_size)
+        position = height - self.margin
+        pdf.drawString(self.margin, position, 'Список покупок')
+        for item in ingredients:
+            position -= self.line_height
+            if position < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, self.font_size)
+                position = height - self.margin
+            pdf.drawString(
+                self.margin, position,
+                f"{item['ingredient__name']} - {item['total']} "
+                f"{item['ingredient__measurement_unit']}"
+            )
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(self.chunk_size), b'')
@@ -1,35 +1,44 @@
+from django.conf import settings
 from django.contrib.auth import authenticate
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
+from django.db.models import F
 from rest_framework import serializers, status
 from rest_framework.fields import SerializerMethodField
 
+from api.authentication import get_client_address, login_failures
+from api.fields import BulkPrimaryKeyRelatedField, RecipeImageField
+from api.metrics import SerializerTimingMixin
+from recipes import carts
 from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
                             Recipe, ShoppingList, Tag)
 from users.models import User, Follow
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SerializerTimingMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SerializerTimingMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
-class RecipeSmallSerializer(serializers.ModelSerializer):
+class RecipeSmallSerializer(SerializerTimingMixin,
+                            serializers.ModelSerializer):
+
+    image = RecipeImageField(variant='thumbnail', read_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SerializerTimingMixin, serializers.ModelSerializer):
 
     is_subscribed = SerializerMethodField(read_only=True)
 
@@ -41,6 +50,8 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('is_subscribed',)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context['request']
         return request.user.is_authenticated and obj.following.filter(
             user=request.user).exists()
@@ -73,16 +84,33 @@ class UserFollowSerializer(UserSerializer):
         return data
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[: int(limit)]
+        if hasattr(obj, 'recipe_previews'):
+            recipes = obj.recipe_previews
+        else:
+            recipes = obj.recipes.all()
+            limit = self.context.get('recipes_limit')
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = RecipeSmallSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BULK_LIMIT,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
 
 
 class TokenSerializer(serializers.Serializer):
@@ -100,15 +128,25 @@ class TokenSerializer(serializers.Serializer):
     def validate(self, value):
         email = value.get('email')
         password = value.get('password')
+        request = self.context.get('request')
+        address = get_client_address(request)
         if email and password:
-            user = authenticate(
-                request=self.context.get('request'),
-                email=email,
-                password=password)
+            user = None
+            if not login_failures.is_blocked(email, address):
+                user = authenticate(
+                    request=request,
+                    email=email,
+                    password=password)
         else:
             raise serializers.ValidationError(
                 detail='Укажите еmail и пароль.',
                 code='authorization')
+        if user is None:
+            login_failures.add(email, address)
+            raise serializers.ValidationError(
+                detail='Неверный email или пароль.',
+                code='authorization')
+        login_failures.reset(email, address)
         value['user'] = user
         return value
 
@@ -127,7 +165,7 @@ class AmountsIngredientSerializer(serializers.ModelSerializer):
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -135,14 +173,14 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SerializerTimingMixin, serializers.ModelSerializer):
 
     tags = TagSerializer(read_only=True, many=True)
     author = UserSerializer(read_only=True)
     ingredients = AmountsIngredientSerializer(
         many=True,
         source='recipe')
-    image = Base64ImageField()
+    image = RecipeImageField(variant='full', list_variant='card')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -154,26 +192,50 @@ class RecipeSerializer(serializers.ModelSerializer):
                   )
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context['request']
         return request.user.is_authenticated and obj.favorites.filter(
             user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context['request']
         return request.user.is_authenticated and obj.shopping_list.filter(
             user=request.user).exists()
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeMatchSerializer(RecipeSerializer):
+
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing')
+
+
+class RecipeMatchQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+    )
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.RECIPE_MATCH_LIMIT, default=20)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class RecipeCreateSerializer(SerializerTimingMixin,
+                             serializers.ModelSerializer):
 
     ingredients = IngredientRecipeSerializer(
         many=True
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
     author = UserSerializer(read_only=True)
 
     class Meta:
@@ -182,27 +244,25 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients',
             'name', 'image', 'text', 'cooking_time',)
 
-    def validate_tag(self, tags):
-        for tag in tags:
-            if not Tag.objects.filter(id=tag.id).exists():
-                raise serializers.ValidationError(
-                    detail='Указанного тэга не существует')
-        return tags
-
     def validate_ingredients(self, ingredients):
-        ingredients_list = []
         if not ingredients:
             raise serializers.ValidationError(
                 detail='Должен быть хотя бы один ингредиент')
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты должны быть уникальны')
+        if any(ingredient['amount'] < 1 for ingredient in ingredients):
+            raise serializers.ValidationError(
+                detail='Количество ингредиента должно быть больше 1')
+        found = Ingredient.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                detail='Ингредиенты с id '
+                       f'{", ".join(map(str, missing))} не существуют')
         for ingredient in ingredients:
-            value = ingredient['id']
-            if value in ingredients_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты должны быть уникальны')
-            ingredients_list.append(ingredient['id'])
-            if int(ingredient.get('amount')) < 1:
-                raise serializers.ValidationError(
-                    detail='Количество ингредиента должно быть больше 1')
+            ingredient['id'] = found[ingredient['id']]
         return ingredients
 
     def validate_time(self, cooking_time):
@@ -221,29 +281,80 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                     amount=ingredient.get('amount')
                 )
             )
-        AmountIngredient.objects.bulk_create(ingredients_recipe)
-
+        if ingredients_recipe:
+            AmountIngredient.objects.bulk_create(ingredients_recipe)
+
+    def update_ingredients(self, ingredients, recipe):
+        """Меняет только добавленные, изменённые и удалённые ингредиенты."""
+        current = {
+            item.ingredient_id: item
+            for item in AmountIngredient.objects.filter(recipe=recipe)
+        }
+        amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        changed = []
+        deltas = {}
+        for ingredient_id, amount in amounts.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                deltas[ingredient_id] = amount
+            elif item.amount != amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        removed = current.keys() - amounts.keys()
+        for ingredient_id in removed:
+            deltas[ingredient_id] = -current[ingredient_id].amount
+        if removed:
+            AmountIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        if changed:
+            AmountIngredient.objects.bulk_update(changed, ['amount'])
+        self.create_ingredients(
+            [
+                ingredient for ingredient in ingredients
+                if ingredient['id'].id not in current
+            ],
+            recipe
+        )
+        carts.change_recipe(recipe, deltas)
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         request = self.context.get('request', None)
         recipe = Recipe.objects.create(author=request.user, **validated_data)
+        User.objects.filter(pk=request.user.pk).update(
+            recipes_count=F('recipes_count') + 1)
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        instance.ingredients.clear()
-        instance.tags.set(validated_data.get('tags'))
-        ingredients = validated_data.pop('ingredients')
-        self.create_ingredients(ingredients, instance)
-        return super().update(instance, validated_data)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.update_ingredients(ingredients, instance)
+        # Пишутся только изменённые поля, чтобы не затереть счётчики
+        # и варианты картинки, обновлённые после загрузки instance.
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.for_serializer(request.user).get(
+            pk=instance.pk)
         return RecipeSerializer(
             instance,
-            context={'request': self.context.get('request')}
+            context={'request': request}
         ).data
 
 
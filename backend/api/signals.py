@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.cache import reference_cache, user_state_namespace
+from recipes.images import variants_built
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingList,
+                            Tag)
+from recipes.signals import ingredients_imported, recipes_changed
+from users.models import Follow, User
+
+
+def invalidate(namespace):
+    # Повторная смена версии после коммита не даёт закэшировать
+    # данные, прочитанные конкурентом до завершения транзакции.
+    reference_cache.invalidate(namespace)
+    transaction.on_commit(lambda: reference_cache.invalidate(namespace))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    invalidate('tags')
+
+
+@receiver(ingredients_imported, sender=Ingredient)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    invalidate('ingredients')
+
+
+@receiver(recipes_changed, sender=Recipe)
+@receiver(variants_built, sender=Recipe)
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipes(sender, **kwargs):
+    invalidate('recipes')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=ShoppingList)
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_user_state(sender, instance, **kwargs):
+    invalidate(user_state_namespace(instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def invalidate_profiles(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields and set(update_fields) <= {
+        'last_login', 'password'
+    }:
+        return
+    invalidate('profiles')
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if created:
+        return
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
+    if keys:
+        token_cache.invalidate(*keys)
+        transaction.on_commit(lambda: token_cache.invalidate(*keys))
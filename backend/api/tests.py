@@ -0,0 +1,255 @@
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api.benchmarks import (create_ingredients, create_recipes, create_users,
+                            get_client)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import carts
+from recipes.models import FavoriteRecipe, Recipe, ShoppingList, Tag
+from users.models import Follow, User
+
+WRITE = re.compile(r'(INSERT|UPDATE|DELETE)(?: INTO| FROM)? "(\w+)"')
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов к списку рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.user = create_users(2)
+        ingredients = create_ingredients(20)
+        recipes = create_recipes(cls.author, ingredients, 100, per_recipe=5)
+        FavoriteRecipe.objects.bulk_create(
+            FavoriteRecipe(user=cls.user, recipe=recipe)
+            for recipe in recipes[::2])
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=cls.user, recipe=recipe)
+            for recipe in recipes[::3])
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_list_queries(self, user, expected):
+        client = get_client(user)
+        for limit in (6, 20, 100):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(None, 4)
+
+    def test_authenticated(self):
+        self.assert_list_queries(self.user, 5)
+
+    def test_feed_cache_keeps_pagination_mode(self):
+        client = get_client()
+        self.assertIn('count', client.get('/api/recipes/').json())
+        self.assertNotIn('count', client.get('/api/recipes/?cursor=').json())
+        self.assertIn('count', client.get('/api/recipes/').json())
+
+
+class RecipeUpdateWritesTest(TestCase):
+    """Изменение одного количества пишет в базу одну строку ингредиента."""
+
+    def setUp(self):
+        self.author, = create_users(1)
+        ingredients = create_ingredients(40)
+        self.tag = Tag.objects.create(
+            name='Тест', color='#000000', slug='test')
+        self.recipe, = create_recipes(
+            self.author, ingredients, 1, per_recipe=30)
+        self.recipe.tags.set([self.tag])
+
+    def test_one_amount_change(self):
+        amounts = [
+            {'id': item.ingredient_id, 'amount': item.amount}
+            for item in self.recipe.recipe.order_by('pk')
+        ]
+        amounts[0]['amount'] = 100
+        with CaptureQueriesContext(connection) as queries:
+            response = get_client(self.author).patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {'ingredients': amounts, 'tags': [self.tag.id]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            match.group(1) for match in (
+                WRITE.match(query['sql']) for query in queries)
+            if match and match.group(2) == 'recipes_amountingredient'
+        ]
+        self.assertEqual(writes, ['UPDATE'])
+        self.assertEqual(
+            self.recipe.recipe.get(ingredient_id=amounts[0]['id']).amount,
+            100)
+
+    def test_update_skips_counters(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = get_client(self.author).patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {'name': 'Новое название', 'tags': [self.tag.id]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "recipes_recipe"')
+        ]
+        self.assertEqual(len(updates), 1)
+        for field in ('favorites_count', 'in_carts_count', 'image_variants'):
+            self.assertNotIn(field, updates[0])
+
+
+class BulkShoppingCartTest(TestCase):
+    """Пакетное добавление в корзину не завышает счётчики и итоги."""
+
+    def setUp(self):
+        cache.clear()
+        author, self.user = create_users(2)
+        ingredients = create_ingredients(10)
+        self.recipes = create_recipes(author, ingredients, 4, per_recipe=3)
+        self.client = get_client(self.user)
+
+    def test_counters_follow_rows(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        ShoppingList.objects.create(user=self.user, recipe=self.recipes[0])
+        for method in ('post', 'post', 'delete', 'post'):
+            response = getattr(self.client, method)(
+                '/api/recipes/shopping_cart/bulk/', {'ids': ids[:3]},
+                format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe.in_carts_count
+             for recipe in Recipe.objects.filter(pk__in=ids).order_by('pk')],
+            [1, 1, 1, 0])
+        self.assertEqual(carts.find_mismatches(), [])
+
+
+class ShoppingCartDownloadTest(TestCase):
+    """ETag выгрузки меняется вместе с корзиной и рецептами в ней."""
+
+    url = '/api/recipes/download_shopping_cart/?format=txt'
+
+    def setUp(self):
+        cache.clear()
+        author, self.user = create_users(2)
+        ingredients = create_ingredients(10)
+        self.recipes = create_recipes(author, ingredients, 2, per_recipe=3)
+        self.client = get_client(self.user)
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+
+    def download(self, **extra):
+        response = self.client.get(self.url, **extra)
+        if response.status_code == 200:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_etag_follows_cart(self):
+        etag = self.download()['ETag']
+        self.assertEqual(
+            self.download(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        item = self.recipes[1].recipe.first()
+        item.amount += 1
+        item.save()
+        self.assertEqual(
+            self.download(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CachedTokenWritesTest(TestCase):
+    """Запрос с токеном из кэша не перезаписывает счётчики пользователя."""
+
+    password = 'Old-pass-123!'
+
+    def setUp(self):
+        cache.clear()
+        self.user, = create_users(1)
+        self.user.set_password(self.password)
+        self.user.save()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}')
+
+    def test_set_password_keeps_counters(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(
+            followers_count=7, recipes_count=3)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': self.password,
+            'new_password': 'Zq9!long-new-pass',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(
+            (self.user.followers_count, self.user.recipes_count), (7, 3))
+        self.assertTrue(self.user.check_password('Zq9!long-new-pass'))
+
+
+class LoginFailuresTest(TestCase):
+    """Перебор пароля с одного адреса не блокирует вход с другого."""
+
+    password = 'Old-pass-123!'
+
+    def setUp(self):
+        cache.clear()
+        self.user, = create_users(1)
+        self.user.set_password(self.password)
+        self.user.save()
+
+    def login(self, password, address):
+        return APIClient().post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': password,
+        }, REMOTE_ADDR=address)
+
+    def test_block_is_per_address(self):
+        for _ in range(settings.LOGIN_FAILURE_LIMIT):
+            self.login('wrong-password', '10.0.0.1')
+        self.assertEqual(self.login(self.password, '10.0.0.1').status_code,
+                         400)
+        self.assertEqual(self.login(self.password, '10.0.0.2').status_code,
+                         201)
+
+
+@override_settings(API_METRICS=True)
+@modify_settings(
+    MIDDLEWARE={'prepend': 'api.middleware.QueryMetricsMiddleware'})
+class MetricsTest(TestCase):
+    """Время сериализации считается отдельно, метрики видит только админ."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin, self.user = create_users(2)
+        self.admin.is_staff = True
+        self.admin.save()
+        create_recipes(self.admin, create_ingredients(10), 20, per_recipe=3)
+
+    def test_serializer_timing(self):
+        response = get_client(self.user).get('/api/recipes/')
+        timings = dict(
+            re.match(r'(\w+);dur=([\d.]+)', part.strip()).groups()
+            for part in response['Server-Timing'].split(',')
+        )
+        self.assertGreater(float(timings['serialize']), 0)
+        self.assertIn(
+            'foodgram_serializer_duration_seconds_total',
+            get_client(self.admin).get('/api/_metrics').content.decode())
+
+    def test_metrics_require_admin(self):
+        self.assertEqual(get_client().get('/api/_metrics').status_code, 401)
+        self.assertEqual(
+            get_client(self.user).get('/api/_metrics').status_code, 403)
+        self.assertEqual(
+            get_client(self.admin).get('/api/_metrics').status_code, 200)
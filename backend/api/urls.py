@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (AuthToken, IngredientViewSet, RecipeViewSet, TagViewSet,
-                    UserViewSet)
+from .views import (AuthToken, IngredientViewSet, MetricsView, RecipeViewSet,
+                    TagViewSet, UserViewSet)
 
 app_name = 'api'
 
@@ -15,6 +15,7 @@ router_v1.register('recipes', RecipeViewSet, 'recipes')
 
 urlpatterns = [
     path('', include(router_v1.urls)),
+    path('_metrics', MetricsView.as_view(), name='metrics'),
     path('auth/token/login/', AuthToken.as_view(), name='login'),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,31 +1,75 @@
-from django.http.response import HttpResponse
+from collections import defaultdict
+from hashlib import md5
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, F, Value
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from api.cache import (ConditionalRecipeMixin, RecipeFeedCacheMixin,
+                       ReferenceCacheMixin, reference_cache,
+                       user_state_namespace)
 from api.filters import RecipeFilters, IngredientFilters
-from api.pagination import LimitPageNumberPagination
+from api.metrics import registry
+from api.pagination import (LimitPageNumberPagination,
+                            OptionalCursorPagination,
+                            OptionalSubscriptionCursorPagination)
 from api.permissions import UserPermission
+from api.renderers import (CSVShoppingListRenderer, PDFShoppingListRenderer,
+                           PrometheusRenderer, ShoppingListNegotiation,
+                           TextShoppingListRenderer)
 from api.serializers import (IngredientSerializer, RecipeCreateSerializer,
-                             RecipeSerializer, RecipeSmallSerializer,
+                             RecipeIdsSerializer, RecipeMatchQuerySerializer,
+                             RecipeMatchSerializer, RecipeSerializer,
+                             RecipeSmallSerializer, RecipesLimitSerializer,
                              TagSerializer, TokenSerializer,
                              UserFollowSerializer, UserSerializer)
-from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
-                            Recipe, ShoppingList, Tag)
+from api.signals import invalidate
+from recipes import carts
+from recipes.management.commands.recount import count_subquery
+from recipes.matching import recipe_matcher
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            ShoppingCartIngredient, ShoppingList, Tag)
+from recipes.search import ingredient_index
 from users.models import Follow, User
 
 
 class UserViewSet(DjoserUserViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.order_by('id')
     serializer_class = UserSerializer
     pagination_class = LimitPageNumberPagination
 
+    def get_recipes_limit(self):
+        serializer = RecipesLimitSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes_limit')
+
+    def add_recipe_previews(self, authors, limit):
+        if not authors:
+            return
+        recipes = Recipe.objects.filter(author__in=authors)
+        if limit is not None:
+            recipes = recipes.limited_per_author(limit)
+        previews = defaultdict(list)
+        for recipe in recipes:
+            previews[recipe.author_id].append(recipe)
+        for author in authors:
+            author.recipe_previews = previews[author.id]
+
     @action(methods=('POST', 'DELETE'), detail=True)
     def subscribe(self, request, id):
         user = self.request.user
@@ -34,21 +78,35 @@ class UserViewSet(DjoserUserViewSet):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         if self.request.method == 'POST':
             serializer = UserFollowSerializer(
-                author, data=request.data, context={'request': request}
+                author, data=request.data, context={
+                    'request': request,
+                    'recipes_limit': self.get_recipes_limit(),
+                }
             )
             serializer.is_valid(raise_exception=True)
-            Follow.objects.create(user=user, author=author)
+            with transaction.atomic():
+                Follow.objects.create(user=user, author=author)
+                User.objects.filter(pk=author.pk).update(
+                    followers_count=F('followers_count') + 1)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        get_object_or_404(Follow, user=user, author=author).delete()
+        with transaction.atomic():
+            get_object_or_404(Follow, user=user, author=author).delete()
+            User.objects.filter(pk=author.pk, followers_count__gt=0).update(
+                followers_count=F('followers_count') - 1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(methods=('GET',), detail=False)
+    @action(methods=('GET',), detail=False,
+            permission_classes=(IsAuthenticated,),
+            pagination_class=OptionalSubscriptionCursorPagination)
     def subscriptions(self, request):
-        user = self.request.user
-        queryset = User.objects.filter(following__user=user)
+        limit = self.get_recipes_limit()
+        queryset = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id')
         pages = self.paginate_queryset(queryset)
-        if user.is_anonymous:
-            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        self.add_recipe_previews(pages, limit)
         serializer = UserFollowSerializer(
             pages, many=True, context={'request': request}
         )
@@ -70,15 +128,16 @@ class AuthToken(ObtainAuthToken):
             status=status.HTTP_201_CREATED)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (UserPermission, )
     pagination_class = None
+    cache_namespace = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -86,37 +145,141 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilters
     pagination_class = None
+    cache_namespace = 'ingredients'
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list' and self.request.query_params.get('name'):
+            return queryset[:settings.INGREDIENT_SEARCH_LIMIT]
+        return queryset
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not (name and settings.INGREDIENT_SEARCH_INDEX):
+            return super().list(request, *args, **kwargs)
+        ingredients = ingredient_index.search(
+            name, settings.INGREDIENT_SEARCH_LIMIT)
+        return Response(self.get_serializer(ingredients, many=True).data)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(RecipeFeedCacheMixin, ConditionalRecipeMixin,
+                    viewsets.ModelViewSet):
 
     queryset = Recipe.objects.all()
     permission_classes = (UserPermission, )
-    pagination_class = LimitPageNumberPagination
+    pagination_class = OptionalCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilters
+    counter_fields = {
+        FavoriteRecipe: 'favorites_count',
+        ShoppingList: 'in_carts_count',
+    }
+
+    def get_queryset(self):
+        return Recipe.objects.for_serializer(self.request.user)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerializer
         return RecipeCreateSerializer
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            carts.delete_recipe(instance)
+            instance.delete()
+            User.objects.filter(
+                pk=instance.author_id, recipes_count__gt=0
+            ).update(recipes_count=F('recipes_count') - 1)
+
     def create_method(self, model, user, pk):
         if model.objects.filter(user=user, recipe__id=pk).exists():
             return Response({'Ошибка': 'Данный рецепт уже добавлен!'},
                             status=status.HTTP_400_BAD_REQUEST)
         recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
-        serializer = RecipeSmallSerializer(recipe)
+        counter = self.counter_fields[model]
+        with transaction.atomic():
+            model.objects.create(user=user, recipe=recipe)
+            Recipe.objects.filter(pk=recipe.pk).update(
+                **{counter: F(counter) + 1})
+            if model is ShoppingList:
+                carts.add_recipes(user, [recipe.pk])
+        serializer = RecipeSmallSerializer(
+            recipe, context=self.get_serializer_context())
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_method(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
-            model.objects.filter(user=user, recipe__id=pk).delete()
+        counter = self.counter_fields[model]
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=user, recipe__id=pk).delete()
+            if deleted:
+                Recipe.objects.filter(pk=pk, **{f'{counter}__gt': 0}).update(
+                    **{counter: F(counter) - 1})
+                if model is ShoppingList:
+                    carts.remove_recipes(user, [pk])
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'Ошибка': 'Данный рецепт уже удален!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    def bulk_method(self, model, request):
+        """Добавляет или удаляет список рецептов одним запросом к базе.
+
+        Возвращает статус по каждому id: created/exists при добавлении,
+        deleted/absent при удалении и not_found для несуществующих.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        counter = self.counter_fields[model]
+        with transaction.atomic():
+            found = set(
+                Recipe.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            entries = model.objects.filter(user=user, recipe_id__in=found)
+            existing = set(entries.values_list('recipe_id', flat=True))
+            if request.method == 'POST':
+                changed = found - existing
+                model.objects.bulk_create(
+                    [model(user=user, recipe_id=pk) for pk in changed],
+                    ignore_conflicts=True,
+                )
+                invalidate(user_state_namespace(user.pk))
+                statuses = ('created', 'exists')
+            else:
+                changed = existing
+                entries.delete()
+                statuses = ('deleted', 'absent')
+            if changed:
+                # Параллельный запрос мог вставить или удалить те же строки,
+                # поэтому счётчики и итоги корзины пересчитываются по факту.
+                Recipe.objects.filter(pk__in=found).update(
+                    **{counter: count_subquery(model, 'recipe')})
+                if model is ShoppingList:
+                    carts.rebuild([user.pk])
+        results = []
+        for pk in ids:
+            if pk not in found:
+                result = 'not_found'
+            else:
+                result = statuses[pk not in changed]
+            results.append({'id': pk, 'status': result})
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(methods=('POST', 'DELETE'),
+            detail=False,
+            url_path='shopping_cart/bulk',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_bulk(self, request):
+        return self.bulk_method(ShoppingList, request)
+
+    @action(methods=('POST', 'DELETE'),
+            detail=False,
+            url_path='favorite/bulk',
+            permission_classes=(IsAuthenticated,))
+    def favorite_bulk(self, request):
+        return self.bulk_method(FavoriteRecipe, request)
+
     @action(methods=('POST', 'DELETE'),
             detail=True)
     def shopping_cart(self, request, pk):
@@ -132,26 +295,81 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.delete_method(FavoriteRecipe, request.user, pk)
 
     @action(detail=False, methods=['GET'])
+    def match(self, request):
+        """Рецепты, которые можно приготовить из указанных ингредиентов."""
+        params = request.query_params
+        data = {
+            key: params[key] for key in ('limit', 'max_missing')
+            if key in params
+        }
+        data['ingredients'] = [
+            value for item in params.getlist('ingredients')
+            for value in item.split(',') if value
+        ]
+        serializer = RecipeMatchQuerySerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        matches = recipe_matcher.match(
+            data['ingredients'], data['limit'], data.get('max_missing'))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in matches])
+        found = []
+        for recipe_id, coverage, missing in matches:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = round(coverage, 4)
+                recipe.missing = missing
+                found.append(recipe)
+        serializer = RecipeMatchSerializer(
+            found, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(TextShoppingListRenderer,
+                              CSVShoppingListRenderer,
+                              PDFShoppingListRenderer),
+            content_negotiation_class=ShoppingListNegotiation)
     def download_shopping_cart(self, request):
-        user = self.request.user
-        shopping_list = user.shopping_list.all()
-        data = {}
-        for point in shopping_list:
-            recipe = point.recipe
-            ingredients = AmountIngredient.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                name = ingredient.ingredient.name
-                measurement_unit = ingredient.ingredient.measurement_unit
-                amount = ingredient.amount
-                if name not in data:
-                    data[name] = {"measurement_unit": measurement_unit,
-                                  "amount": amount}
-                else:
-                    data[name]["amount"] = (data[name]["amount"] + amount)
-        shoppinglist = []
-        for name, data in data.items():
-            shoppinglist.append(
-                f"{name} - {data['amount']} {data['measurement_unit']},\n"
+        renderer = request.accepted_renderer
+        # Итоги меняются вместе с корзиной пользователя, составом
+        # рецептов и названиями ингредиентов, поэтому ETag строится
+        # из их версий без запроса к базе.
+        versions = [
+            reference_cache.get_version(namespace) for namespace in (
+                user_state_namespace(request.user.pk),
+                'recipes',
+                'ingredients',
+            )
+        ]
+        etag = quote_etag(md5(
+            f'{renderer.format}:{versions}'.encode()
+        ).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            ingredients = ShoppingCartIngredient.objects.filter(
+                user=request.user
+            ).values(
+                'ingredient__name', 'ingredient__measurement_unit', 'total'
+            ).order_by('ingredient__name')
+            response = StreamingHttpResponse(
+                renderer.stream(ingredients.iterator()),
+                content_type=f'{renderer.media_type}; '
+                             f'charset={renderer.charset}'
             )
-        response = HttpResponse(shoppinglist, content_type='text/plain')
+            response['Content-Disposition'] = (
+                f'attachment; filename="shopping_list.{renderer.format}"'
+            )
+        response['ETag'] = etag
         return response
+
+
+class MetricsView(APIView):
+
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        if not settings.API_METRICS:
+            raise NotFound
+        return Response(registry.export())
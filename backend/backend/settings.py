@@ -39,6 +39,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+API_METRICS = os.getenv('API_METRICS', default='False') == 'True'
+
+API_METRICS_N_PLUS_ONE_THRESHOLD = int(
+    os.getenv('API_METRICS_N_PLUS_ONE_THRESHOLD', default=5))
+
+if API_METRICS:
+    MIDDLEWARE.insert(0, 'api.middleware.QueryMetricsMiddleware')
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -70,6 +78,59 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+REFERENCE_CACHE_ALIAS = 'default'
+
+REFERENCE_CACHE_SIZE = int(os.getenv('REFERENCE_CACHE_SIZE', default=128))
+
+REFERENCE_CACHE_TIMEOUT = int(
+    os.getenv('REFERENCE_CACHE_TIMEOUT', default=24 * 60 * 60))
+
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', default=10000))
+
+AUTH_TOKEN_CACHE_LOCAL_TIMEOUT = int(
+    os.getenv('AUTH_TOKEN_CACHE_LOCAL_TIMEOUT', default=10))
+
+AUTH_TOKEN_CACHE_TIMEOUT = int(
+    os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', default=5 * 60))
+
+
+# Хэш пароля пересчитывается первым хэшером списка при следующем входе,
+# если пароль сохранён другим алгоритмом или с другими параметрами.
+PASSWORD_HASHERS = os.getenv(
+    'PASSWORD_HASHERS',
+    default=(
+        'users.hashers.TunedArgon2PasswordHasher,'
+        'users.hashers.TunedBCryptSHA256PasswordHasher,'
+        'users.hashers.TunedPBKDF2PasswordHasher,'
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher'
+    )
+).split(',')
+
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', default=2))
+
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', default=19 * 1024))
+
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', default=1))
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', default=12))
+
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', default=260000))
+
+LOGIN_FAILURE_LIMIT = int(os.getenv('LOGIN_FAILURE_LIMIT', default=5))
+
+LOGIN_FAILURE_TIMEOUT = int(os.getenv('LOGIN_FAILURE_TIMEOUT', default=60))
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -102,6 +163,55 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+
+INGREDIENT_SEARCH_INDEX = os.getenv(
+    'INGREDIENT_SEARCH_INDEX', default='False') == 'True'
+
+INGREDIENT_SEARCH_INDEX_TTL = int(
+    os.getenv('INGREDIENT_SEARCH_INDEX_TTL', default=300))
+
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=5 * 1024 * 1024))
+
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.getenv('RECIPE_IMAGE_MAX_PIXELS', default=25_000_000))
+
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', default='WEBP')
+
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (320, 320),
+    'card': (640, 640),
+    'full': (1280, 1280),
+}
+
+RECIPE_BULK_LIMIT = int(os.getenv('RECIPE_BULK_LIMIT', default=100))
+
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', default='russian')
+
+RECIPE_CACHE_MAX_AGE = int(os.getenv('RECIPE_CACHE_MAX_AGE', default=60))
+
+RECIPE_FEED_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FEED_CACHE_TIMEOUT', default=60))
+
+RECIPE_FEED_CACHE_LOCK_TIMEOUT = int(
+    os.getenv('RECIPE_FEED_CACHE_LOCK_TIMEOUT', default=10))
+
+RECIPE_FEED_CACHE_WAIT = float(
+    os.getenv('RECIPE_FEED_CACHE_WAIT', default=1))
+
+RECIPE_MATCH_LIMIT = int(os.getenv('RECIPE_MATCH_LIMIT', default=100))
+
+RECIPE_MATCH_INDEX_TTL = int(
+    os.getenv('RECIPE_MATCH_INDEX_TTL', default=60 * 60))
+
 AUTH_USER_MODEL = 'users.User'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -111,8 +221,37 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', default='WARNING'),
+        },
+        'recipes': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', default='WARNING'),
+        },
+    },
 }
 
 DJOSER = {
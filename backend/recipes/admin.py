@@ -1,7 +1,12 @@
+from collections import Counter, defaultdict
+
 from django.contrib import admin
+from django.db import transaction
 
+from . import carts
 from .models import (AmountIngredient, FavoriteRecipe, Ingredient, Recipe,
                      ShoppingList, Tag)
+from .signals import recipes_changed
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -17,6 +22,34 @@ class AmountIngredientAdmin(admin.ModelAdmin):
     search_fields = ('ingredient',)
     empty_value_display = '-пусто-'
 
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        deltas = defaultdict(Counter)
+        if change:
+            old = AmountIngredient.objects.get(pk=obj.pk)
+            deltas[old.recipe_id][old.ingredient_id] -= old.amount
+        super().save_model(request, obj, form, change)
+        deltas[obj.recipe_id][obj.ingredient_id] += obj.amount
+        for recipe_id, amounts in deltas.items():
+            carts.change_recipe(recipe_id, amounts)
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        carts.change_recipe(obj.recipe_id, {obj.ingredient_id: -obj.amount})
+        super().delete_model(request, obj)
+        recipes_changed.send(sender=Recipe, recipe_ids=[obj.recipe_id])
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        deltas = defaultdict(Counter)
+        for recipe_id, ingredient_id, amount in queryset.values_list(
+                'recipe_id', 'ingredient_id', 'amount'):
+            deltas[recipe_id][ingredient_id] -= amount
+        for recipe_id, amounts in deltas.items():
+            carts.change_recipe(recipe_id, amounts)
+        super().delete_queryset(request, queryset)
+        recipes_changed.send(sender=Recipe, recipe_ids=set(deltas))
+
 
 class TagAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'color', 'slug')
@@ -33,7 +66,18 @@ class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
     def in_favorites(self, instance):
-        return instance.favorites.count()
+        return instance.favorites_count
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        carts.delete_recipe(obj)
+        super().delete_model(request, obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        for recipe in queryset:
+            carts.delete_recipe(recipe)
+        super().delete_queryset(request, queryset)
 
 
 class FavoriteRecipeAdmin(admin.ModelAdmin):
@@ -49,6 +93,26 @@ class ShoppingListAdmin(admin.ModelAdmin):
     search_fields = ('user',)
     empty_value_display = '-пусто-'
 
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        if change:
+            carts.remove_entries(
+                ShoppingList.objects.filter(pk=obj.pk)
+                .values_list('user_id', 'recipe_id'))
+        super().save_model(request, obj, form, change)
+        if obj.user_id is not None:
+            carts.add_recipes(obj.user, [obj.recipe_id])
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        carts.remove_entries([(obj.user_id, obj.recipe_id)])
+        super().delete_model(request, obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        carts.remove_entries(queryset.values_list('user_id', 'recipe_id'))
+        super().delete_queryset(request, queryset)
+
 
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(AmountIngredient, AmountIngredientAdmin)
@@ -0,0 +1,169 @@
+"""Поддержка таблицы ShoppingCartIngredient.
+
+Все функции меняют только затронутые строки и должны вызываться в той же
+транзакции, что и изменение ShoppingList или AmountIngredient.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import AmountIngredient, ShoppingCartIngredient, ShoppingList
+
+
+def recipe_amounts(recipe_ids):
+    """Количество каждого ингредиента в сумме по рецептам."""
+    return Counter(dict(
+        AmountIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .values('ingredient_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+        .values_list('ingredient_id', 'total')
+    ))
+
+
+def apply_deltas(deltas):
+    """Применяет изменения вида {(user_id, ingredient_id): delta}.
+
+    Недостающие строки сначала вставляются с нулём через
+    ignore_conflicts, чтобы параллельные добавления одного ингредиента
+    не упирались в unique_cart_ingredient, а затем все строки
+    блокируются и меняются.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    ShoppingCartIngredient.objects.bulk_create(
+        (
+            ShoppingCartIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, total=0)
+            for (user_id, ingredient_id), delta in deltas.items()
+            if delta > 0
+        ),
+        ignore_conflicts=True,
+    )
+    user_ids = {user_id for user_id, _ in deltas}
+    ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+    rows = {
+        (row.user_id, row.ingredient_id): row
+        for row in ShoppingCartIngredient.objects.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=ingredient_ids)
+    }
+    changed, removed = [], []
+    for key, delta in deltas.items():
+        row = rows.get(key)
+        if row is None:
+            continue
+        row.total += delta
+        if row.total > 0:
+            changed.append(row)
+        else:
+            removed.append(row.pk)
+    if removed:
+        ShoppingCartIngredient.objects.filter(pk__in=removed).delete()
+    if changed:
+        ShoppingCartIngredient.objects.bulk_update(changed, ['total'])
+
+
+def add_recipes(user, recipe_ids, sign=1):
+    amounts = recipe_amounts(recipe_ids)
+    apply_deltas({
+        (user.pk, ingredient_id): sign * total
+        for ingredient_id, total in amounts.items()
+    })
+
+
+def remove_recipes(user, recipe_ids):
+    add_recipes(user, recipe_ids, sign=-1)
+
+
+def remove_entries(entries):
+    """Вычитает из списков покупок пары (user_id, recipe_id)."""
+    recipes_by_user = defaultdict(list)
+    for user_id, recipe_id in entries:
+        if user_id is not None:
+            recipes_by_user[user_id].append(recipe_id)
+    apply_deltas({
+        (user_id, ingredient_id): -total
+        for user_id, recipe_ids in recipes_by_user.items()
+        for ingredient_id, total in recipe_amounts(recipe_ids).items()
+    })
+
+
+def change_recipe(recipe, amounts):
+    """Переносит в списки покупок изменения {ingredient_id: delta}."""
+    amounts = {key: delta for key, delta in amounts.items() if delta}
+    if not amounts:
+        return
+    user_ids = ShoppingList.objects.filter(
+        recipe=recipe).values_list('user_id', flat=True)
+    apply_deltas({
+        (user_id, ingredient_id): delta
+        for user_id in user_ids
+        for ingredient_id, delta in amounts.items()
+    })
+
+
+def delete_recipe(recipe):
+    """Вычитает рецепт из всех списков покупок перед его удалением."""
+    change_recipe(recipe, {
+        ingredient_id: -total
+        for ingredient_id, total in recipe_amounts([recipe.pk]).items()
+    })
+
+
+def live_totals(user_ids=None):
+    """Итоги, посчитанные по ShoppingList и AmountIngredient."""
+    lookup = {'recipe__shopping_list__user__isnull': False}
+    if user_ids is not None:
+        lookup = {'recipe__shopping_list__user_id__in': user_ids}
+    queryset = AmountIngredient.objects.filter(**lookup)
+    totals = defaultdict(int)
+    for user_id, ingredient_id, total in (
+        queryset.values('recipe__shopping_list__user_id', 'ingredient_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+        .values_list('recipe__shopping_list__user_id', 'ingredient_id',
+                     'total')
+    ):
+        totals[user_id, ingredient_id] = total
+    return totals
+
+
+def stored_totals(user_ids=None):
+    queryset = ShoppingCartIngredient.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in queryset.values_list(
+            'user_id', 'ingredient_id', 'total')
+    }
+
+
+def find_mismatches(user_ids=None):
+    """Строки, где сохранённый итог расходится с живым подсчётом."""
+    live = live_totals(user_ids)
+    stored = stored_totals(user_ids)
+    return sorted(
+        (key, stored.get(key, 0), live.get(key, 0))
+        for key in live.keys() | stored.keys()
+        if stored.get(key, 0) != live.get(key, 0)
+    )
+
+
+@transaction.atomic
+def rebuild(user_ids=None, batch_size=1000):
+    queryset = ShoppingCartIngredient.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    queryset.delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (
+            ShoppingCartIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, total=total)
+            for (user_id, ingredient_id), total in live_totals(
+                user_ids).items()
+        ),
+        batch_size=batch_size,
+    )
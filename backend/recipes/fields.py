@@ -0,0 +1,28 @@
+from django.db import models
+
+
+class SearchVectorField(models.Field):
+    """Колонка tsvector в PostgreSQL и обычный текст в остальных базах.
+
+    django.contrib.postgres требует psycopg2, поэтому для локального
+    запуска на SQLite поле объявлено здесь.
+    """
+
+    description = 'Поисковый вектор'
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'tsvector'
+        return 'text'
+
+
+@SearchVectorField.register_lookup
+class Matches(models.Lookup):
+    """vector @@ query для поиска по GIN-индексу."""
+
+    lookup_name = 'matches'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} @@ {rhs}', [*lhs_params, *rhs_params]
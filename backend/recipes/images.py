@@ -0,0 +1,73 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = None
+
+variants_built = Signal()
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    return executor
+
+
+def variant_name(name, variant):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    extension = settings.RECIPE_IMAGE_FORMAT.lower()
+    return os.path.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def build_variants(recipe_id, name):
+    """Сохраняет уменьшенные копии изображения и записывает их в рецепт."""
+    try:
+        with default_storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+        modes = ('RGB',) if settings.RECIPE_IMAGE_FORMAT == 'JPEG' else (
+            'RGB', 'RGBA')
+        if image.mode not in modes:
+            image = image.convert(modes[-1])
+        variants = {'source': name}
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size)
+            buffer = BytesIO()
+            resized.save(buffer, settings.RECIPE_IMAGE_FORMAT, quality=85)
+            variants[variant] = default_storage.save(
+                variant_name(name, variant), ContentFile(buffer.getvalue()))
+        updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=variants, updated_at=timezone.now())
+        if updated:
+            variants_built.send(sender=Recipe, recipe_id=recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        connections.close_all()
+
+
+def schedule_variants(recipe):
+    name = recipe.image.name
+    if not name or recipe.image_variants.get('source') == name:
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(build_variants, recipe.pk, name))
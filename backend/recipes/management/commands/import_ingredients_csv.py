@@ -1,18 +1,94 @@
+import json
+import os
 from csv import reader
+from itertools import islice
+from time import perf_counter
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from recipes.models import Ingredient
+from recipes.signals import ingredients_imported
+
+
+def read_csv(file):
+    for row in reader(file):
+        if len(row) == 2:
+            yield row[0], row[1]
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив ингредиентов.')
+    position = 1
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise CommandError('Файл JSON оборван.')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON пакетами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='data/ingredients.csv',
+            help='Путь к файлу с ингредиентами (.csv или .json)')
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Формат файла, по умолчанию определяется по расширению')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк в одном INSERT')
 
-    def handle(self, *args, **kwargs):
-        with open(
-                'data/ingredients.csv', 'r',
-                encoding='UTF-8'
-        ) as ingredients:
-            for row in reader(ingredients):
-                if len(row) == 2:
-                    Ingredient.objects.get_or_create(
-                        name=row[0], measurement_unit=row[1],
-                    )
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.')
+        )
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше 0.')
+        before = Ingredient.objects.count()
+        total = 0
+        start = perf_counter()
+        with open(path, 'r', encoding='UTF-8') as file:
+            rows = READERS[file_format](file)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create(
+                    (
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in batch
+                    ),
+                    ignore_conflicts=True,
+                )
+                total += len(batch)
+        elapsed = perf_counter() - start
+        created = Ingredient.objects.count() - before
+        ingredients_imported.send(sender=Ingredient)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {total}, добавлено: {created}, '
+            f'за {elapsed:.2f} с ({total / max(elapsed, 1e-9):.0f} строк/с)'
+        ))
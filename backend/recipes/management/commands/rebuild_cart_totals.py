@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes import carts
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает итоги списков покупок из ShoppingList и '
+            'AmountIngredient или, с --check, только сверяет их.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сравнить сохранённые итоги с живым подсчётом')
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='id пользователя; можно указать несколько раз')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = options['users']
+        if not options['check']:
+            carts.rebuild(users, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                'Итоги списков покупок пересобраны.'))
+            return
+        mismatches = carts.find_mismatches(users)
+        for (user_id, ingredient_id), stored, live in mismatches[:50]:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id} '
+                f'сохранено={stored} должно быть={live}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Расхождений: {len(mismatches)}. '
+                'Запустите rebuild_cart_totals без --check.')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
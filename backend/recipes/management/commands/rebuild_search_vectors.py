@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from recipes.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые векторы всех рецептов (PostgreSQL).'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(
+                'Поисковые векторы используются только в PostgreSQL.')
+            return
+        update_search_vectors()
+        self.stdout.write(self.style.SUCCESS('Поисковые векторы обновлены.'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import FavoriteRecipe, Recipe, ShoppingList
+from users.models import Follow, User
+
+
+def count_subquery(model, field):
+    """Количество строк model, ссылающихся на текущий объект через field."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики рецептов '
+            'и пользователей.')
+
+    counters = (
+        (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+        (Recipe, 'in_carts_count', ShoppingList, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'followers_count', Follow, 'author'),
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, related, lookup in self.counters:
+                actual = count_subquery(related, lookup)
+                drift = model.objects.annotate(actual=actual).filter(
+                    ~Q(**{field: actual})).count()
+                model.objects.update(**{field: actual})
+                self.stdout.write(
+                    f'{model._meta.model_name}.{field}: '
+                    f'исправлено {drift}'
+                )
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
@@ -0,0 +1,178 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from recipes.models import (AmountIngredient, FavoriteRecipe, Ingredient,
+                            Recipe, ShoppingList, Tag)
+from recipes.signals import recipes_changed
+from users.models import Follow, User
+
+
+def zipf_weights(count, exponent=1.1):
+    """Накопленные веса: первые элементы популярнее остальных."""
+    return list(accumulate(
+        1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def pick_unique(rng, population, weights, count):
+    """До count разных элементов с учётом популярности."""
+    picked = {}
+    for item in rng.choices(population, cum_weights=weights, k=count * 2):
+        picked[item.pk] = item
+        if len(picked) >= count:
+            break
+    return list(picked.values())
+
+
+class Command(BaseCommand):
+    help = ('Генерирует нагрузочные данные: пользователей, рецепты, '
+            'подписки, избранное и корзины.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--authors-share', type=float, default=0.2,
+            help='Доля пользователей, публикующих рецепты')
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Максимум подписок на пользователя')
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Максимум избранных рецептов на пользователя')
+        parser.add_argument(
+            '--carts', type=int, default=10,
+            help='Максимум рецептов в корзине пользователя')
+        parser.add_argument('--prefix', default='load')
+        parser.add_argument(
+            '--password', default='Load-Test-Password',
+            help='Пароль всех созданных пользователей')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        tags = list(Tag.objects.all())
+        if not ingredients or not tags:
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги: '
+                'import_ingredients_csv и import_tags_csv.')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже существуют.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        start = perf_counter()
+        with transaction.atomic():
+            users = self.create_users(
+                prefix, options['users'], options['password'])
+            authors_count = int(len(users) * options['authors_share'])
+            authors = users[:max(1, authors_count)]
+            recipes = self.create_recipes(
+                authors, ingredients, tags, options['recipes'])
+            self.create_relations(users, authors, recipes, options)
+            call_command('recount', stdout=self.stdout)
+            call_command('rebuild_cart_totals', stdout=self.stdout)
+            call_command('rebuild_search_vectors', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)} '
+            f'за {perf_counter() - start:.1f} с'
+        ))
+
+    def create_users(self, prefix, count, password):
+        password = make_password(password)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{prefix}{number}',
+                    email=f'{prefix}{number}@example.com',
+                    first_name='Нагрузка',
+                    last_name=str(number),
+                    password=password,
+                ) for number in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        return list(
+            User.objects.filter(username__startswith=prefix).order_by('pk'))
+
+    def create_recipes(self, authors, ingredients, tags, count):
+        rng = self.rng
+        author_weights = zipf_weights(len(authors))
+        ingredient_weights = zipf_weights(len(ingredients), exponent=0.8)
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=author,
+                    name=f'Рецепт {number}',
+                    image='recipes/image/load.jpg',
+                    text='Описание рецепта ' * rng.randint(5, 60),
+                    cooking_time=rng.randint(5, 180),
+                ) for number, author in enumerate(
+                    rng.choices(
+                        authors, cum_weights=author_weights, k=count))
+            ),
+            batch_size=self.batch_size,
+        )
+        recipes = list(
+            Recipe.objects.filter(author__in=authors).order_by('pk'))
+        now = timezone.now()
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                minutes=rng.randint(0, 365 * 24 * 60))
+        Recipe.objects.bulk_update(
+            recipes, ['pub_date'], batch_size=self.batch_size)
+        AmountIngredient.objects.bulk_create(
+            (
+                AmountIngredient(
+                    recipe=recipe,
+                    ingredient=ingredient,
+                    amount=rng.randint(1, 500),
+                )
+                for recipe in recipes
+                for ingredient in pick_unique(
+                    rng, ingredients, ingredient_weights, rng.randint(3, 12))
+            ),
+            batch_size=self.batch_size,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe=recipe, tag=tag)
+                for recipe in recipes
+                for tag in rng.sample(tags, rng.randint(1, len(tags)))
+            ),
+            batch_size=self.batch_size,
+        )
+        recipes_changed.send(sender=Recipe)
+        return recipes
+
+    def create_relations(self, users, authors, recipes, options):
+        rng = self.rng
+        author_weights = zipf_weights(len(authors))
+        recipe_weights = zipf_weights(len(recipes), exponent=0.9)
+        relations = (
+            (Follow, 'author', authors, author_weights, options['follows']),
+            (FavoriteRecipe, 'recipe', recipes, recipe_weights,
+             options['favorites']),
+            (ShoppingList, 'recipe', recipes, recipe_weights,
+             options['carts']),
+        )
+        for model, field, population, weights, limit in relations:
+            model.objects.bulk_create(
+                (
+                    model(user=user, **{field: target})
+                    for user in users
+                    for target in pick_unique(
+                        rng, population, weights, rng.randint(0, limit))
+                    if target != user
+                ),
+                batch_size=self.batch_size,
+                ignore_conflicts=True,
+            )
@@ -0,0 +1,206 @@
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import AmountIngredient
+
+
+class RecipeMatcher:
+    """Битовые маски ингредиент -> рецепты в памяти процесса.
+
+    Каждому рецепту выделяется позиция, маска ингредиента содержит
+    единицы на позициях рецептов с этим ингредиентом, маска размера -
+    на позициях рецептов с таким числом ингредиентов. Число совпадений
+    считается поразрядным сложением масок, поэтому поиск не перебирает
+    рецепты по одному.
+
+    Изменённые рецепты публикуются в общий кэш Django как журнал
+    с номерами, и каждый воркер перед поиском перечитывает из базы только
+    рецепты из новых записей журнала. Если журнал потерян или прошло
+    больше ttl секунд, индекс строится заново.
+    """
+
+    key = 'recipe_matcher'
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+        self.lock = Lock()
+        self.recipes = None
+        self.positions = {}
+        self.recipe_ids = []
+        self.masks = {}
+        self.size_masks = {}
+        self.sequence = 0
+        self.built_at = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def get_sequence(self):
+        return self.shared.get(f'{self.key}:sequence', 0)
+
+    def publish(self, recipe_ids):
+        self.shared.add(f'{self.key}:sequence', 0, None)
+        sequence = self.shared.incr(f'{self.key}:sequence')
+        self.shared.set(
+            f'{self.key}:{sequence}', list(recipe_ids), self.ttl)
+
+    def changed(self, recipe_ids):
+        """Отмечает рецепты изменёнными после фиксации транзакции."""
+        recipe_ids = list(recipe_ids)
+        transaction.on_commit(lambda: self.publish(recipe_ids))
+
+    def invalidate(self):
+        with self.lock:
+            self.recipes = None
+
+    def load(self):
+        self.sequence = self.get_sequence()
+        recipes = {}
+        for recipe_id, ingredient_id in AmountIngredient.objects.order_by(
+            'recipe_id'
+        ).values_list('recipe_id', 'ingredient_id').iterator():
+            recipes.setdefault(recipe_id, []).append(ingredient_id)
+        size = len(recipes) // 8 + 1
+        bitmaps = defaultdict(lambda: bytearray(size))
+        size_bitmaps = defaultdict(lambda: bytearray(size))
+        for position, ingredients in enumerate(recipes.values()):
+            byte, bit = position >> 3, 1 << (position & 7)
+            for ingredient_id in ingredients:
+                bitmaps[ingredient_id][byte] |= bit
+            size_bitmaps[len(ingredients)][byte] |= bit
+        self.recipes = {
+            recipe_id: tuple(ingredients)
+            for recipe_id, ingredients in recipes.items()
+        }
+        self.recipe_ids = list(recipes)
+        self.positions = {
+            recipe_id: position
+            for position, recipe_id in enumerate(self.recipe_ids)
+        }
+        self.masks = {
+            key: int.from_bytes(bitmap, 'little')
+            for key, bitmap in bitmaps.items()
+        }
+        self.size_masks = {
+            key: int.from_bytes(bitmap, 'little')
+            for key, bitmap in size_bitmaps.items()
+        }
+        self.built_at = monotonic()
+
+    def set_bit(self, masks, key, bit, value):
+        mask = masks.get(key, 0)
+        mask = mask | bit if value else mask & ~bit
+        if mask:
+            masks[key] = mask
+        else:
+            masks.pop(key, None)
+
+    def refresh(self, recipe_ids):
+        current = {}
+        for recipe_id, ingredient_id in AmountIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current.setdefault(recipe_id, []).append(ingredient_id)
+        for recipe_id in sorted(recipe_ids):
+            old = self.recipes.pop(recipe_id, ())
+            new = tuple(current.get(recipe_id, ()))
+            if recipe_id not in self.positions:
+                if not new:
+                    continue
+                self.positions[recipe_id] = len(self.recipe_ids)
+                self.recipe_ids.append(recipe_id)
+            bit = 1 << self.positions[recipe_id]
+            if old:
+                self.set_bit(self.size_masks, len(old), bit, False)
+            for ingredient_id in set(old) - set(new):
+                self.set_bit(self.masks, ingredient_id, bit, False)
+            for ingredient_id in set(new) - set(old):
+                self.set_bit(self.masks, ingredient_id, bit, True)
+            if new:
+                self.recipes[recipe_id] = new
+                self.set_bit(self.size_masks, len(new), bit, True)
+
+    def sync(self):
+        if self.recipes is None or monotonic() - self.built_at > self.ttl:
+            self.load()
+            return
+        sequence = self.get_sequence()
+        if sequence <= self.sequence:
+            return
+        keys = [
+            f'{self.key}:{number}'
+            for number in range(self.sequence + 1, sequence + 1)
+        ]
+        entries = self.shared.get_many(keys)
+        if len(entries) < len(keys):
+            self.load()
+            return
+        self.refresh({
+            recipe_id for recipe_ids in entries.values()
+            for recipe_id in recipe_ids
+        })
+        self.sequence = sequence
+
+    def count_hits(self, ingredient_ids):
+        """Поразрядные счётчики совпадений и маска рецептов с совпадениями.
+
+        Бит j числа совпадений рецепта лежит в counters[j].
+        """
+        width = max(self.size_masks, default=0).bit_length()
+        counters = [0] * width
+        matched = 0
+        for ingredient_id in set(ingredient_ids):
+            carry = self.masks.get(ingredient_id, 0)
+            matched |= carry
+            for digit in range(width):
+                if not carry:
+                    break
+                counters[digit], carry = (
+                    counters[digit] ^ carry, counters[digit] & carry)
+        return counters, matched
+
+    def match(self, ingredient_ids, limit, max_missing=None):
+        """Рецепты по доле имеющихся ингредиентов, затем по числу
+        недостающих. Возвращает [(recipe_id, coverage, missing)].
+        """
+        with self.lock:
+            self.sync()
+            counters, matched = self.count_hits(ingredient_ids)
+            groups = sorted(
+                (
+                    ((size - missing) / size, -missing, size)
+                    for size in self.size_masks
+                    for missing in range(size)
+                    if max_missing is None or missing <= max_missing
+                ),
+                reverse=True,
+            )
+            found = []
+            for coverage, missing, size in groups:
+                if len(found) >= limit:
+                    break
+                mask = self.size_masks[size] & matched
+                hits = size + missing
+                for digit, counter in enumerate(counters):
+                    if not mask:
+                        break
+                    mask &= counter if hits >> digit & 1 else ~counter
+                while mask and len(found) < limit:
+                    position = mask.bit_length() - 1
+                    mask ^= 1 << position
+                    found.append(
+                        (self.recipe_ids[position], coverage, -missing))
+            return found
+
+
+recipe_matcher = RecipeMatcher(
+    alias=settings.REFERENCE_CACHE_ALIAS,
+    ttl=settings.RECIPE_MATCH_INDEX_TTL,
+)
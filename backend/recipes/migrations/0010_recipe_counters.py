@@ -0,0 +1,44 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:54
+
+from django.db import migrations, models
+
+from recipes.management.commands.recount import count_subquery
+
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.FavoriteRecipe', 'recipe'),
+    ('recipes.Recipe', 'in_carts_count', 'recipes.ShoppingList', 'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model, field, related, lookup in COUNTERS:
+        apps.get_model(model).objects.update(
+            **{field: count_subquery(apps.get_model(related), lookup)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_variants'),
+        ('users', '0004_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,11 @@
 from django.core import validators
 from django.db import models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
-from users.models import User
+from users.models import Follow, User
+
+from .fields import SearchVectorField
 
 
 class Tag(models.Model):
@@ -43,11 +47,81 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def add_user_annotations(self, user):
+        """Флаги избранного и корзины одним запросом вместе с рецептами."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingList.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        )
+
+    def prefetch_for_serializer(self, user):
+        """Связанные данные, которые читает RecipeSerializer.
+
+        Автор для авторизованного пользователя подгружается отдельным
+        запросом с флагом подписки, для анонима - через JOIN.
+        """
+        queryset = self.prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe',
+                queryset=AmountIngredient.objects.select_related(
+                    'ingredient')
+            ),
+        )
+        if not user.is_authenticated:
+            return queryset.select_related('author')
+        return queryset.prefetch_related(models.Prefetch(
+            'author',
+            queryset=User.objects.annotate(
+                is_subscribed=models.Exists(Follow.objects.filter(
+                    user=user, author=models.OuterRef('pk'))))
+        ))
+
+    def for_serializer(self, user):
+        return self.add_user_annotations(user).prefetch_for_serializer(user)
+
+    def limited_per_author(self, limit):
+        """Не более limit последних рецептов каждого автора.
+
+        Django 3.2 не умеет фильтровать по оконным функциям, поэтому
+        ROW_NUMBER() считается во вложенном запросе.
+        """
+        ranked = self.annotate(
+            position=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F('author'),
+                order_by=[models.F('pub_date').desc(), models.F('pk').desc()],
+            )
+        ).values('pk', 'position')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE position <= %s',
+            (*params, limit)
+        ))
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -63,6 +137,12 @@ class Recipe(models.Model):
         upload_to='recipes/image/',
         verbose_name='Изображение рецепта',
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения',
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
     )
@@ -88,11 +168,43 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата создания'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date'], name='recipe_pub_date_idx'),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date'],
+                name='recipe_popular_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -184,3 +296,38 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return self.user.username
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Таблица поддерживается функциями из recipes.carts и пересобирается
+    командой rebuild_cart_totals.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Пользователь')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент')
+    total = models.PositiveIntegerField(
+        verbose_name='Общее количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        ordering = ['user']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient}'
@@ -0,0 +1,107 @@
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Отсортированный массив названий ингредиентов в памяти процесса.
+
+    Совпадения по началу названия ищутся бинарным поиском, вхождения
+    в середине названия добираются линейным проходом. Индекс строится
+    при первом запросе и перестраивается после изменения ингредиентов
+    или по истечении ttl секунд.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.keys = None
+        self.entries = ()
+        self.built_at = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.keys = None
+
+    def load(self):
+        entries = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit')
+        )
+        self.entries = entries
+        self.keys = [entry[0] for entry in entries]
+        self.built_at = monotonic()
+
+    def get_entries(self):
+        with self.lock:
+            if self.keys is None or monotonic() - self.built_at > self.ttl:
+                self.load()
+            return self.keys, self.entries
+
+    def search(self, query, limit):
+        query = query.casefold()
+        keys, entries = self.get_entries()
+        found = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(entries[position])
+            position += 1
+        if len(found) < limit:
+            for key, entry in zip(keys, entries):
+                if query in key and not key.startswith(query):
+                    found.append(entry)
+                    if len(found) >= limit:
+                        break
+        return [
+            Ingredient(pk=pk, name=name, measurement_unit=measurement_unit)
+            for _, pk, name, measurement_unit in found
+        ]
+
+
+ingredient_index = IngredientIndex(ttl=settings.INGREDIENT_SEARCH_INDEX_TTL)
+
+
+SEARCH_VECTOR_SQL = '''
+    UPDATE recipes_recipe AS recipe SET search_vector =
+        setweight(to_tsvector(%(config)s::regconfig, recipe.name), 'A')
+        || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_amountingredient AS amount
+            JOIN recipes_ingredient AS ingredient
+                ON ingredient.id = amount.ingredient_id
+            WHERE amount.recipe_id = recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s::regconfig, recipe.text), 'C')
+'''
+
+
+def update_search_vectors(recipe_ids=None):
+    """Пересчитывает Recipe.search_vector; None - для всех рецептов.
+
+    Вне PostgreSQL поиск идёт по icontains и вектор не нужен.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    sql = SEARCH_VECTOR_SQL
+    params = {'config': settings.RECIPE_SEARCH_CONFIG}
+    if recipe_ids is not None:
+        sql += 'WHERE recipe.id = ANY(%(ids)s)'
+        params['ids'] = list(recipe_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def schedule_search_vectors(recipe_ids):
+    """Пересчитывает векторы рецептов один раз после фиксации транзакции,
+    когда их ингредиенты уже записаны."""
+    if connection.vendor != 'postgresql':
+        return
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: update_search_vectors(recipe_ids))
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .images import schedule_variants
+from .matching import recipe_matcher
+from .models import AmountIngredient, Ingredient, Recipe
+from .search import ingredient_index, schedule_search_vectors
+
+ingredients_imported = Signal()
+# Изменения рецептов в обход Recipe.save(): recipe_ids - затронутые
+# рецепты или None, если изменено сразу много.
+recipes_changed = Signal()
+
+
+@receiver(ingredients_imported, sender=Ingredient)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def create_image_variants(sender, instance, **kwargs):
+    schedule_variants(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(sender, instance, **kwargs):
+    schedule_search_vectors([instance.pk])
+    recipe_matcher.changed([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_matcher(sender, instance, **kwargs):
+    recipe_matcher.changed([instance.pk])
+
+
+@receiver(recipes_changed, sender=Recipe)
+def update_changed_recipes(sender, recipe_ids=None, **kwargs):
+    if recipe_ids is None:
+        return
+    schedule_search_vectors(recipe_ids)
+    recipe_matcher.changed(recipe_ids)
+
+
+@receiver(post_save, sender=AmountIngredient)
+def update_ingredient_search(sender, instance, **kwargs):
+    recipes_changed.send(sender=Recipe, recipe_ids=[instance.recipe_id])
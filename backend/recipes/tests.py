@@ -0,0 +1,108 @@
+import json
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from api.benchmarks import create_ingredients, create_recipes, create_users
+from recipes import carts
+from recipes.models import AmountIngredient, Ingredient, ShoppingList
+
+INGREDIENTS = [
+    ('абрикосы', 'г'),
+    ('базилик', 'г'),
+    ('ванилин', 'г'),
+    ('абрикосы', 'г'),
+]
+
+
+class ImportIngredientsTest(TestCase):
+    """Повторная загрузка того же файла не добавляет ингредиентов."""
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.paths = {
+            'csv': os.path.join(directory.name, 'ingredients.csv'),
+            'json': os.path.join(directory.name, 'ingredients.json'),
+        }
+        with open(self.paths['csv'], 'w', encoding='UTF-8') as file:
+            file.writelines(f'{name},{unit}\n' for name, unit in INGREDIENTS)
+        with open(self.paths['json'], 'w', encoding='UTF-8') as file:
+            json.dump([
+                {'name': name, 'measurement_unit': unit}
+                for name, unit in INGREDIENTS
+            ], file, ensure_ascii=False)
+
+    def import_file(self, path):
+        stdout = StringIO()
+        call_command('import_ingredients_csv', path, batch_size=2,
+                     stdout=stdout)
+        return stdout.getvalue()
+
+    def test_reimport_is_idempotent(self):
+        for file_format, path in self.paths.items():
+            with self.subTest(format=file_format):
+                Ingredient.objects.all().delete()
+                self.assertIn('добавлено: 3', self.import_file(path))
+                self.assertEqual(Ingredient.objects.count(), 3)
+                self.assertIn('добавлено: 0', self.import_file(path))
+                self.assertEqual(Ingredient.objects.count(), 3)
+
+
+class AdminCartTotalsTest(TestCase):
+    """Правки в админке не расходятся с итогами списков покупок."""
+
+    def setUp(self):
+        self.admin, self.user = create_users(2)
+        self.admin.is_staff = self.admin.is_superuser = True
+        self.admin.save()
+        self.client.force_login(self.admin)
+        self.ingredients = create_ingredients(5)
+        self.recipes = create_recipes(
+            self.admin, self.ingredients, 3, per_recipe=3)
+
+    def assert_in_sync(self):
+        self.assertEqual(carts.find_mismatches(), [])
+
+    def test_shopping_list_and_amounts(self):
+        recipe = self.recipes[0]
+        for other in self.recipes:
+            self.client.post('/admin/recipes/shoppinglist/add/', {
+                'user': self.user.pk, 'recipe': other.pk})
+        self.assertEqual(ShoppingList.objects.count(), 3)
+        self.assert_in_sync()
+
+        item = recipe.recipe.order_by('pk').first()
+        self.client.post(
+            f'/admin/recipes/amountingredient/{item.pk}/change/', {
+                'ingredient': self.ingredients[-1].pk,
+                'amount': item.amount + 5,
+                'recipe': recipe.pk,
+            })
+        item.refresh_from_db()
+        self.assertEqual(item.ingredient_id, self.ingredients[-1].pk)
+        self.assert_in_sync()
+
+        self.client.post('/admin/recipes/amountingredient/', {
+            'action': 'delete_selected',
+            '_selected_action': list(
+                recipe.recipe.values_list('pk', flat=True)[:2]),
+            'post': 'yes',
+        })
+        self.assertEqual(recipe.recipe.count(), 1)
+        self.assert_in_sync()
+
+        entry = ShoppingList.objects.get(recipe=self.recipes[1])
+        self.client.post(
+            f'/admin/recipes/shoppinglist/{entry.pk}/delete/',
+            {'post': 'yes'})
+        self.client.post(
+            f'/admin/recipes/recipe/{self.recipes[2].pk}/delete/',
+            {'post': 'yes'})
+        self.assertEqual(ShoppingList.objects.count(), 1)
+        self.assertFalse(AmountIngredient.objects.filter(
+            recipe=self.recipes[2]).exists())
+        self.assert_in_sync()